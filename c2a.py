@@ -1,31 +1,54 @@
 #!/usr/bin/python3
+import os
 import sys
-from os.path import basename, splitext
 import csv
+import json
+import shutil
+import struct
+import argparse
+import tempfile
+from io import BytesIO, StringIO
+from glob import glob
+from hashlib import blake2b
+from functools import lru_cache
+from os.path import basename, dirname, splitext, isdir, join
+from concurrent.futures import ProcessPoolExecutor
+from fe5py.tables import Layout, EnumType, parse_type
+from fe5py.symbols import SymbolTable
 
+MANIFEST_VERSION = 2
 
-def add_def(definition, value):
-    definitions.append(f'{definition.ljust(reserved, " ")} = {value}\n')
+# Entries are held in memory up to this size
+# before being spilled to a temporary file.
+SPOOL_SIZE = 1 << 20
 
+description = "Converts formatted CSV tables into 64tass source."
 
-if __name__ == "__main__":
+epilog = "Usage for a single table: c2a.py csvfile outfile [indent]"
 
-    (inname, outname), indent = sys.argv[1:3], 2
+batch_help = "convert every .csv file in these directories or glob " \
+    "patterns, writing each table to csvfile.asm"
 
-    if len(sys.argv) == 4:
-        try:
-            indent = int(sys.argv[3])
-        except:
-            print(f'Invalid spacing "{sys.argv[3]}", ignoring')
+indent_help = "indentation for definitions in batch mode (default: 2)"
 
-    tablename = splitext(basename(inname))[0].strip()
+jobs_help = "number of processes to convert tables with in batch mode"
 
-    with open(inname, "r", encoding="UTF-8") as c:
-        sheet = csv.reader(c)
-        row1 = next(sheet)
-        rows = [row for row in sheet]
+layout_help = "write the table as packed binary data instead, using " \
+    "one field type per field, i.e. \"u8 s16 p24\""
+
+binary_help = "file to write binary data to (default: outfile with " \
+    "a .bin extension)"
 
-    parts = row1[0].split()
+symbols_help = "symbol file used to resolve labels in typed columns " \
+    "and binary tables"
+
+manifest_help = "file to track converted tables in, so unchanged tables " \
+    "are skipped (default: .c2a_manifest.json)"
+
+
+def parse_command(cell):
+    """Splits the upper-left cell into a command, start index and step."""
+    parts = cell.split()
 
     if (len(parts) == 3):
         (command, start, step) = parts
@@ -36,30 +59,396 @@ if __name__ == "__main__":
         command = parts[0]
         start, step = 0, 1
     else:
-        raise ValueError(f"Unable to parse first cell: {row1[0]}.")
+        raise ValueError(f"Unable to parse first cell: {cell}.")
+
+    return (command, int(start), int(step))
+
+
+@lru_cache(maxsize=None)
+def load_symbols(filename):
+    """Loads a symbol file through its cache, once per process."""
+    return SymbolTable.from_file(filename)
+
+
+@lru_cache(maxsize=None)
+def load_enum(filename):
+    """Reads a table's entry names and indexes for use as an enum."""
+    try:
+        with open(filename, "r", encoding="UTF-8") as c:
+            sheet = csv.reader(c)
+            _, start, step = parse_command(next(sheet)[0])
+            return {
+                row[0]: start + (index * step)
+                for index, row in enumerate(sheet) if row
+                }
+    except OSError as e:
+        raise ValueError(f"Unable to read enum table {filename}: {e}")
+
+
+def enum_files(inname, cells):
+    """Gets the filenames of the enum tables used by a table's columns."""
+    files = []
+    for cell in cells:
+        _, _, kind = cell.partition(":")
+        if kind.startswith("enum:"):
+            files.append(join(dirname(inname), kind[5:]))
+    return files
+
+
+def parse_fields(inname, cells):
+    """Splits the top row's cells into field names and column types.
+    Columns are typed by adding `:type` to their names, i.e.
+    `.Might:u8`, `.Level:1..20`, `.Item:enum:ITEMS.csv` or `.Ptr:sym`.
+    Untyped columns have a type of None.
+    """
+    fields, types = [], []
+    enums = iter(enum_files(inname, cells))
+
+    for column, cell in enumerate(cells, start=2):
+        name, _, kind = cell.partition(":")
+        fields.append(name)
+
+        try:
+            if not kind:
+                types.append(None)
+            elif kind.startswith("enum:"):
+                filename = next(enums)
+                types.append(EnumType(basename(filename), load_enum(filename)))
+            else:
+                types.append(parse_type(kind))
+        except ValueError as e:
+            raise ValueError(f"column {column} ({name}): {e}")
+
+    return (fields, types)
+
+
+def fold_cell(t, item, symbols=None):
+    """Replaces a cell with the literal value of its column type,
+    if it has one.
+    """
+    return item if t is None else t.format(t.resolve(item, symbols))
+
 
-    fields = row1[1:]
-    start = int(start)
-    step = int(step)
+def scan_table(inname, symbols=None, layout=None):
+    """First pass over a CSV table: reads its top row and the width
+    of its longest entry name, and checks every typed cell. If a
+    layout is given, every row and cell is also checked against it.
+    Returns (command, start, step, fields, types, namewidth).
+    Raises ValueError listing every invalid cell.
+    """
+    with open(inname, "r", encoding="UTF-8") as c:
+        sheet = csv.reader(c)
+        if (row1 := next(sheet, None)) is None:
+            raise ValueError("Table is empty.")
+
+        command, start, step = parse_command(row1[0])
+        fields, types = parse_fields(inname, row1[1:])
+
+        if layout is None:
+            checked = [(i, t) for i, t in enumerate(types) if t is not None]
+        elif len(fields) != len(layout):
+            raise ValueError(
+                f"Layout has {len(layout)} fields, table has {len(fields)}.")
+        else:
+            checked = list(enumerate(types))
+
+        namewidth, errors = 0, []
+
+        for row in sheet:
+            namewidth = max(namewidth, len(row[0]))
+
+            if (layout is not None) and (len(row) > len(fields) + 1):
+                errors.append(
+                    f"line {sheet.line_num} ({row[0]}): expected "
+                    f"{len(fields)} values, got {len(row) - 1}.")
+
+            for i, t in checked:
+                try:
+                    if (i + 1) >= len(row):
+                        raise ValueError("Missing value.")
+                    item = fold_cell(t, row[i + 1], symbols)
+                    if layout is not None:
+                        layout.resolve(i, item, symbols)
+                except ValueError as e:
+                    errors.append(
+                        f"line {sheet.line_num}, column {i + 2} "
+                        f"({fields[i]}): {e}")
+
+    if errors:
+        raise ValueError(
+            f"{len(errors)} invalid cells:\n  " + "\n  ".join(errors))
+
+    return (command, start, step, fields, types, namewidth)
+
+
+def write_table(inname, o, indent=2, symbols=None, scan=None):
+    """Converts a CSV table into 64tass source, writing it to `o`.
+    The table is read twice, once for the widths of its columns and
+    to check its typed cells, and once to write it, so only a row is
+    held in memory at a time. Entries are spooled to a temporary file
+    until the definitions have been written. Typed cells are folded
+    into literals. `scan` is an earlier result of `scan_table`.
+    """
+
+    tablename = splitext(basename(inname))[0].strip()
+
+    if scan is None:
+        scan = scan_table(inname, symbols)
 
-    fieldwidth = max(len(f) for f in fields)
-    namewidth = max(len(row[0]) for row in rows)
+    command, start, step, fields, types, namewidth = scan
+
+    fieldwidth = max((len(f) for f in fields), default=0)
     reserved = indent + namewidth + fieldwidth
+    spaces = " " * indent
+
+    with open(inname, "r", encoding="UTF-8") as c, \
+            tempfile.SpooledTemporaryFile(SPOOL_SIZE, "w+",
+                encoding="UTF-8") as table:
+
+        sheet = csv.reader(c)
+        next(sheet)
+
+        for index, [name, *items] in enumerate(sheet):
+
+            o.write(f'{name.ljust(reserved, " ")} = {start + (index * step)}\n')
+            for i, item in enumerate(items):
+                item = fold_cell(types[i], item, symbols)
+                field = spaces + name + fields[i]
+                o.write(f'{field.ljust(reserved, " ")} = {item}\n')
+
+            o.write("\n")
+
+            args = ", ".join([name + field for field in fields])
+            table.write(f"{name}{tablename}Entry {command} {args}\n")
+
+        table.seek(0)
+        shutil.copyfileobj(table, o)
+
+
+def convert(inname, indent=2, symbols=None):
+    """Converts a CSV table into 64tass source, returned as a string."""
+    o = StringIO()
+    write_table(inname, o, indent, symbols)
+    return o.getvalue()
 
-    definitions, table = [], []
 
-    for index, [name, *items] in enumerate(rows):
+def write_binary(inname, layout, o, b, symbols=None, scan=None):
+    """Converts a CSV table into packed binary data, writing the index
+    definitions to `o` and the data to `b`. Like `write_table`, the
+    table is checked in a first pass and each row is packed and written
+    as it's read in a second, so only a row is held in memory at a
+    time. Typed cells are folded the same way as in source output.
+    `scan` is an earlier result of `scan_table` with this layout.
+    """
 
-        add_def(name, start + (index * step))
-        for i, item in enumerate(items):
-            field = (" " * indent) + name + fields[i]
-            add_def(field, item)
+    if scan is None:
+        scan = scan_table(inname, symbols, layout)
 
-        definitions.append("\n")
+    _, start, step, _, types, namewidth = scan
 
-        args = ", ".join([name + field for field in fields])
-        table.append(f"{name}{tablename}Entry {command} {args}\n")
+    with open(inname, "r", encoding="UTF-8") as c:
+        sheet = csv.reader(c)
+        next(sheet)
+
+        for index, [name, *items] in enumerate(sheet):
+
+            value = start + (index * step)
+            o.write(f'{name.ljust(namewidth, " ")} = {value}\n')
+
+            b.write(layout.pack([
+                layout.resolve(i, fold_cell(types[i], item, symbols), symbols)
+                for i, item in enumerate(items)
+                ]))
+
+
+def convert_binary(inname, layout, symbols=None):
+    """Converts a CSV table into packed binary data.
+    Returns 64tass source with only the index definitions
+    and the binary data.
+    Raises ValueError listing every invalid cell.
+    """
+    o, b = StringIO(), BytesIO()
+    write_binary(inname, layout, o, b, symbols)
+    return (o.getvalue(), b.getvalue())
+
+
+def write_if_changed(outname, text):
+    """Writes a file only if its contents would change,
+    leaving its modification time alone otherwise.
+    Returns whether the file was written.
+    """
+    data = text.encode("UTF-8")
+
+    try:
+        with open(outname, "rb") as i:
+            if i.read() == data:
+                return False
+    except OSError:
+        pass
+
+    with open(outname, "wb") as o:
+        o.write(data)
+
+    return True
+
+
+def table_hash(inname, indent, symname=None):
+    """Hashes a table's contents along with the options
+    and files that affect its output.
+    """
+    with open(inname, "rb") as i:
+        data = i.read()
+    h = blake2b(data, digest_size=16)
+    h.update(f"{MANIFEST_VERSION} {indent}".encode("UTF-8"))
+
+    if symname is not None:
+        s = os.stat(symname)
+        h.update(f" {symname} {s.st_size} {s.st_mtime_ns}".encode("UTF-8"))
+
+    row1 = next(csv.reader([data.decode("UTF-8").partition("\n")[0]]), [])
+    for filename in enum_files(inname, row1[1:]):
+        with open(filename, "rb") as i:
+            h.update(i.read())
+
+    return h.hexdigest()
+
+
+def batch_convert(inname, indent, symname=None):
+    """Process pool worker: converts a table
+    and writes it if it changed. Invalid and malformed
+    tables raise ValueError naming the table, rather
+    than stopping the batch.
+    """
+    symbols = load_symbols(symname) if symname else None
+    try:
+        text = convert(inname, indent, symbols)
+    except ValueError as e:
+        raise ValueError(f"{inname}: {e}") from None
+    except (StopIteration, IndexError, csv.Error, struct.error) as e:
+        raise ValueError(f"{inname}: malformed table ({e!r})") from None
+    return write_if_changed(inname + ".asm", text)
+
+
+def find_tables(paths):
+    """Expands directories and glob patterns into CSV filenames."""
+    found = []
+    for path in paths:
+        if isdir(path):
+            found.extend(glob(join(path, "*.csv")))
+        else:
+            found.extend(glob(path))
+    return sorted({os.path.normpath(f) for f in found})
+
+
+def batch(paths, indent, jobs, manifest_name, symname=None):
+    """Converts many tables on a process pool,
+    skipping tables that haven't changed since
+    they were last converted.
+    """
+
+    try:
+        with open(manifest_name, "r", encoding="UTF-8") as i:
+            manifest = json.load(i)
+        if manifest.get("version") != MANIFEST_VERSION:
+            manifest = {}
+    except (OSError, ValueError):
+        manifest = {}
+
+    tables = manifest.get("tables", {})
+
+    pending, errors = {}, []
+    for inname in find_tables(paths):
+        try:
+            digest = table_hash(inname, indent, symname)
+        except (ValueError, OSError) as e:
+            tables.pop(inname, None)
+            errors.append(f"{inname}: {e}")
+            continue
+        if (tables.get(inname) == digest) and os.path.isfile(inname + ".asm"):
+            continue
+        pending[inname] = digest
+
+    with ProcessPoolExecutor(jobs) as pool:
+        futures = {
+            inname: pool.submit(batch_convert, inname, indent, symname)
+            for inname in pending
+            }
+
+        for inname, future in futures.items():
+            try:
+                if future.result():
+                    print(f"{inname} -> {inname}.asm")
+                tables[inname] = pending[inname]
+            except ValueError as e:
+                tables.pop(inname, None)
+                errors.append(str(e))
+            except OSError as e:
+                tables.pop(inname, None)
+                errors.append(f"{inname}: {e}")
+
+    with open(manifest_name, "w", encoding="UTF-8") as o:
+        json.dump({"version": MANIFEST_VERSION, "tables": tables}, o, indent=2)
+
+    if errors:
+        sys.exit("\n".join(errors))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=description, epilog=epilog)
+    parser.add_argument("args", nargs="*", help=argparse.SUPPRESS)
+    parser.add_argument("-b", "--batch", nargs="+", metavar="path",
+        help=batch_help)
+    parser.add_argument("--indent", type=int, default=2, help=indent_help)
+    parser.add_argument("-j", "--jobs", type=int, help=jobs_help)
+    parser.add_argument("-l", "--layout", help=layout_help)
+    parser.add_argument("--binary", help=binary_help)
+    parser.add_argument("-s", "--symbols", help=symbols_help)
+    parser.add_argument("-m", "--manifest", default=".c2a_manifest.json",
+        help=manifest_help)
+    options = parser.parse_args()
+
+    if options.batch and options.layout:
+        parser.error("--layout can't be used with --batch")
+
+    if options.batch:
+        batch(options.batch, options.indent, options.jobs, options.manifest,
+            options.symbols)
+        sys.exit()
+
+    if len(options.args) not in (2, 3):
+        parser.error("expected csvfile outfile [indent]")
+
+    (inname, outname), indent = options.args[0:2], 2
+
+    if len(options.args) == 3:
+        try:
+            indent = int(options.args[2])
+        except:
+            print(f'Invalid spacing "{options.args[2]}", ignoring')
+
+    symbols = load_symbols(options.symbols) if options.symbols else None
+
+    if options.layout:
+        layout = Layout.parse(options.layout)
+
+        binname = options.binary or (splitext(outname)[0] + ".bin")
+
+        try:
+            scan = scan_table(inname, symbols, layout)
+        except ValueError as e:
+            sys.exit(f"{inname}: {e}")
+
+        with open(binname, "wb", buffering=SPOOL_SIZE) as b, \
+                open(outname, "w", encoding="UTF-8",
+                    buffering=SPOOL_SIZE) as o:
+            write_binary(inname, layout, o, b, symbols, scan)
+
+    else:
+        try:
+            scan = scan_table(inname, symbols)
+        except ValueError as e:
+            sys.exit(f"{inname}: {e}")
 
-    with open(outname, "w", encoding="UTF-8") as o:
-        o.writelines(definitions)
-        o.writelines(table)
+        with open(outname, "w", encoding="UTF-8", buffering=SPOOL_SIZE) as o:
+            write_table(inname, o, indent, symbols, scan)
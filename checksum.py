@@ -1,6 +1,7 @@
 #!/usr/bin/python3
 
 import sys
+from fe5py.memory import fix_checksum
 
 if __name__ == "__main__":
 
@@ -9,14 +10,8 @@ if __name__ == "__main__":
     with open(ROMfile, "rb") as i:
         ROM = bytearray(i.read())
 
-    oldsum = int.from_bytes(ROM[0x7FDE:0x7FE0], "little")
-
-    checksum = sum(ROM) & 0xFFFF
-    complement = (checksum ^ 0xFFFF) & 0xFFFF
-
-    if checksum != oldsum:
-        ROM[0x7FDC:0x7FDE] = complement.to_bytes(2, "little")
-        ROM[0x7FDE:0x7FE0] = checksum.to_bytes(2, "little")
+    if (fixed := fix_checksum(ROM)) is not None:
+        checksum, complement = fixed
 
         with open(ROMfile, "wb") as o:
             o.write(ROM)
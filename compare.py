@@ -1,14 +1,25 @@
 #!/usr/bin/python3
 
-import sys
+import re
+import argparse
 from os.path import basename
+from itertools import combinations
 
 """
 This script prints differences between
 two files in a series of hexdumps.
 
+Given more than two files, it instead prints
+a table of the ranges that differ and which
+pairs of files differ in each range.
+
 """
 
+BANK_SIZE = 0x8000
+
+NONZERO = re.compile(rb"[^\x00]+")
+
+
 def format_bin(data):
   return "".join(["{0:02X}{1}".format(b, "\n" if ((i+1) % 16) == 0 else " ") for (i, b) in enumerate(data)])
 
@@ -27,43 +38,139 @@ def diff(fname1, fname2, f1, f2, offset, diffsize):
   yield ""
 
 
-if __name__ == "__main__":
-
-  fname1, fname2 = sys.argv[1], sys.argv[2]
+def diff_ranges(f1, f2):
+  """
+  Returns a list of (start, end) ranges where two files differ,
+  up to the length of the shorter file.
+  """
+  size = min(len(f1), len(f2))
+
+  # XORing both files as big ints leaves zeros
+  # everywhere the files match, which lets a regex
+  # find the runs of differing bytes.
+  x = int.from_bytes(f1[:size], "big") ^ int.from_bytes(f2[:size], "big")
+  x = x.to_bytes(size, "big")
+
+  return [m.span() for m in NONZERO.finditer(x)]
+
+
+def pair_ranges(files):
+  """
+  Gets the differing ranges of every pair of files.
+  Returns a dict of {pair: [(start, end), ...], ...}.
+  """
+  return {
+    p: diff_ranges(files[p[0]], files[p[1]])
+    for p in combinations(range(len(files)), 2)
+    }
+
+
+def drift(ranges):
+  """
+  Splits the files into ranges where the set of differing pairs
+  is constant, given each pair's ranges from `pair_ranges`. Yields
+  (start, end, pairs) for each range where any pair of files differs.
+  """
+  pairs = list(ranges)
+
+  events = sorted({pos for r in ranges.values() for span in r for pos in span})
+  cursors = {p: 0 for p in pairs}
+
+  for (start, end) in zip(events, events[1:]):
+    differing = []
+    for p in pairs:
+      r, i = ranges[p], cursors[p]
+      while (i < len(r)) and (r[i][1] <= start):
+        i += 1
+      cursors[p] = i
+      if (i < len(r)) and (r[i][0] <= start):
+        differing.append(p)
+    if differing:
+      yield (start, end, differing)
+
+
+def bank_histogram(ranges, bank_size=BANK_SIZE):
+  """
+  Counts the differing bytes in each bank for each pair of files,
+  given each pair's ranges from `pair_ranges`.
+  Returns a dict of {bank: {pair: count, ...}, ...}.
+  """
+  banks = {}
+  for (p, r) in ranges.items():
+    for (start, end) in r:
+      while start < end:
+        bank = start // bank_size
+        stop = min(end, (bank + 1) * bank_size)
+        counts = banks.setdefault(bank, {})
+        counts[p] = counts.get(p, 0) + (stop - start)
+        start = stop
+  return dict(sorted(banks.items()))
+
+
+def print_table(names, files, histogram=False):
+  """Prints a range table and an optional per-bank histogram."""
+  short = [basename(n) for n in names]
+  pair_name = lambda p: f"{short[p[0]]}/{short[p[1]]}"
+
+  # Each pair is only compared once for both reports.
+  ranges = pair_ranges(files)
+
+  print(f"{'Start':<8} {'End':<8} {'Size':<8} Differs")
+  for (start, end, pairs) in drift(ranges):
+    differing = " ".join(pair_name(p) for p in pairs)
+    print(f"{start:06X}   {end-1:06X}   {end-start:06X}   {differing}")
+
+  if histogram:
+    pairs = list(ranges)
+    width = max(len(pair_name(p)) for p in pairs)
+
+    print()
+    print("Bank " + " ".join(pair_name(p).rjust(width) for p in pairs))
+    for (bank, counts) in bank_histogram(ranges).items():
+      row = " ".join(f"{counts.get(p, 0):>{width}d}" for p in pairs)
+      print(f"0x{bank:02X} {row}")
 
-  with open(fname1, "rb") as i:
-    f1 = i.read()
 
-  with open(fname2, "rb") as i:
-    f2 = i.read()
-
-  s1, s2 = len(f1), len(f2)
+if __name__ == "__main__":
 
-  if (s1 != s2):
+  parser = argparse.ArgumentParser(
+    description = "Prints differences between files.",
+    epilog = "More than two files always produce a range table.",
+    )
+  parser.add_argument("files", nargs="+", metavar="file", help="file to compare")
+  parser.add_argument(
+    "-t", "--table",
+    action = "store_true",
+    help = "print a range table instead of hexdumps",
+    )
+  parser.add_argument(
+    "-b", "--banks",
+    action = "store_true",
+    help = "also print a per-bank histogram of differing bytes",
+    )
+  args = parser.parse_args()
+
+  if len(args.files) < 2:
+    parser.error("at least two files are required")
+
+  files = []
+  for fname in args.files:
+    with open(fname, "rb") as i:
+      files.append(i.read())
+
+  sizes = [len(f) for f in files]
+
+  if len(set(sizes)) != 1:
 
     print("File lengths do not match:")
-    print(f"{basename(fname1)}: 0x{s1:06X}")
-    print(f"{basename(fname2)}: 0x{s2:06X}")
-
-  offset = 0
-  maxsize = min(s1, s2)
-
-  while (offset+1 < maxsize):
-
-    if (f1[offset] != f2[offset]):
-
-      diffsize = 1
-      while (f1[offset+diffsize] != f2[offset+diffsize]):
-
-        diffsize += 1
-
-        if (offset+diffsize >=  maxsize):
-          break
-
-      print(*diff(fname1, fname2, f1, f2, offset, diffsize), sep="\n")
+    for (fname, size) in zip(args.files, sizes):
+      print(f"{basename(fname)}: 0x{size:06X}")
 
-      offset += diffsize
+  if (len(files) > 2) or args.table or args.banks:
+    print_table(args.files, files, args.banks)
 
-    else:
+  else:
+    (fname1, fname2), (f1, f2) = args.files, files
 
-      offset += 1
+    for (offset, end) in diff_ranges(f1, f2):
+      print(*diff(fname1, fname2, f1, f2, offset, end - offset), sep="\n")
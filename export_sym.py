@@ -0,0 +1,49 @@
+#!/usr/bin/python3
+
+import os
+import argparse
+from contextlib import ExitStack
+from fe5py.symbols import symbol_formats, export_symbols
+
+
+def main():
+
+  parser = argparse.ArgumentParser(
+    description = "Converts 64tass VICE symbols into debugger symbol files.",
+    epilog = "All formats are written in a single pass over the symbol file.",
+    )
+  parser.add_argument(
+    "symfile",
+    help = "64tass VICE symbol file",
+    )
+  parser.add_argument(
+    "-f", "--formats",
+    nargs = "+",
+    choices = list(symbol_formats.keys()),
+    default = list(symbol_formats.keys()),
+    help = "formats to write, defaults to all of them",
+    )
+  parser.add_argument(
+    "-o", "--output",
+    help = "output path without an extension, defaults to the symbol file's",
+    )
+
+  args = parser.parse_args()
+
+  base = args.output if args.output else os.path.splitext(args.symfile)[0]
+
+  with ExitStack() as stack:
+    i = stack.enter_context(open(args.symfile, "r", encoding="UTF-8"))
+
+    outputs = {}
+    for name in args.formats:
+      extension = symbol_formats[name][0]
+      outputs[name] = stack.enter_context(
+        open(base + extension, "w", encoding="UTF-8")
+        )
+
+    export_symbols(i, outputs)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,174 @@
+
+import os
+import sys
+import struct
+from array import array
+from math import cbrt
+from typing import Iterable, Optional, Sequence
+
+
+__all__ = [
+  "oklab", "oklab_table", "rgb555_index",
+  "distance", "nearest", "nearest_indices",
+  ]
+
+
+CACHE_MAGIC = b"FE5L"
+CACHE_VERSION = 1
+CACHE_NAME = os.path.join(
+  os.path.dirname(os.path.abspath(__file__)), "oklab.cache"
+  )
+
+# magic, version, color count
+_cache_header = struct.Struct("<4sII")
+
+_table = None
+
+
+def _linear(channel: int) -> float:
+  """Internal helper to convert an 8-bit sRGB channel into linear light."""
+  c = channel / 255
+  return (c / 12.92) if (c <= 0.04045) else (((c + 0.055) / 1.055) ** 2.4)
+
+
+def oklab(rgb: Sequence[int]) -> tuple[float, float, float]:
+  """Converts an RGB tuple into OKLab (L, a, b) coordinates."""
+  r, g, b = [_linear(c) for c in rgb]
+
+  l = cbrt((0.4122214708 * r) + (0.5363325363 * g) + (0.0514459929 * b))
+  m = cbrt((0.2119034982 * r) + (0.6806995451 * g) + (0.1073969566 * b))
+  s = cbrt((0.0883024619 * r) + (0.2817188376 * g) + (0.6299787005 * b))
+
+  return (
+    (0.2104542553 * l) + (0.7936177850 * m) - (0.0040720468 * s),
+    (1.9779984951 * l) - (2.4285922050 * m) + (0.4505937099 * s),
+    (0.0259040371 * l) + (0.7827717662 * m) - (0.8086757660 * s),
+    )
+
+
+def rgb555_index(rgb: Sequence[int]) -> int:
+  """Gets the RGB555 value of an RGB tuple, for indexing `oklab_table`."""
+  r, g, b = rgb
+  return (r >> 3) | ((g >> 3) << 5) | ((b >> 3) << 10)
+
+
+def _build_table() -> array:
+  """Internal helper to compute OKLab coordinates for every RGB555 color."""
+  table = array("f")
+  for color in range(0x8000):
+    rgb = [((color >> shift) & 0b11111) << 3 for shift in (0, 5, 10)]
+    table.extend(oklab(rgb))
+  return table
+
+
+def load_table(filename: str = CACHE_NAME) -> Optional[array]:
+  """Loads a cached OKLab table. Returns None if it's missing or invalid."""
+  try:
+    with open(filename, "rb") as i:
+      data = i.read()
+  except OSError:
+    return None
+
+  if len(data) < _cache_header.size:
+    return None
+
+  magic, version, count = _cache_header.unpack_from(data)
+  if (magic, version, count) != (CACHE_MAGIC, CACHE_VERSION, 0x8000):
+    return None
+
+  table = array("f")
+  table.frombytes(data[_cache_header.size:])
+  if len(table) != (count * 3):
+    return None
+
+  if sys.byteorder != "little":
+    table.byteswap()
+
+  return table
+
+
+def save_table(table: array, filename: str = CACHE_NAME):
+  """Saves an OKLab table to a cache file."""
+  data = array("f", table)
+  if sys.byteorder != "little":
+    data.byteswap()
+
+  with open(filename, "wb") as o:
+    o.write(_cache_header.pack(CACHE_MAGIC, CACHE_VERSION, len(table) // 3))
+    o.write(data.tobytes())
+
+
+def oklab_table(filename: Optional[str] = CACHE_NAME) -> array:
+  """
+  Gets a flat array of OKLab (L, a, b) coordinates for every RGB555
+  color, indexed by `rgb555_index(color) * 3`. The table is computed
+  once and cached in `filename`, if given. If the cache can't be
+  written, the table is just kept in memory.
+  """
+  global _table
+
+  if _table is not None:
+    return _table
+
+  if filename is not None:
+    _table = load_table(filename)
+
+  if _table is None:
+    _table = _build_table()
+    if filename is not None:
+      try:
+        save_table(_table, filename)
+      except OSError:
+        pass
+
+  return _table
+
+
+def distance(l: Sequence[int], r: Sequence[int]) -> float:
+  """
+  Gets the squared OKLab distance between two RGB tuples.
+  `Palette.requantize` uses this when `perceptual` is set.
+  """
+  table = oklab_table()
+  i, j = rgb555_index(l) * 3, rgb555_index(r) * 3
+  return (
+    ((table[i] - table[j]) ** 2)
+    + ((table[i+1] - table[j+1]) ** 2)
+    + ((table[i+2] - table[j+2]) ** 2)
+    )
+
+
+def nearest(color: Sequence[int], palette: Sequence[Sequence[int]]) -> int:
+  """Gets the index of the perceptually closest palette color."""
+  return nearest_indices([color], palette)[0]
+
+
+def nearest_indices(
+    colors: Iterable[Sequence[int]],
+    palette: Sequence[Sequence[int]],
+    ) -> list[int]:
+  """
+  Maps RGB tuples, like an image's pixels, to the indices of their
+  perceptually closest palette colors. The palette's coordinates are
+  looked up once, and each distinct RGB555 color is only compared
+  against the palette once, so the cost grows with the number of
+  distinct colors rather than the number of pixels.
+  """
+  table = oklab_table()
+  points = [
+    tuple(table[i:i+3]) for i in [rgb555_index(p) * 3 for p in palette]
+    ]
+
+  found = {}
+  indices = []
+  for color in colors:
+    key = rgb555_index(color)
+    if (index := found.get(key)) is None:
+      l, a, b = table[key*3:key*3+3]
+      distances = [
+        ((l - pl) ** 2) + ((a - pa) ** 2) + ((b - pb) ** 2)
+        for (pl, pa, pb) in points
+        ]
+      index = found[key] = distances.index(min(distances))
+    indices.append(index)
+  return indices
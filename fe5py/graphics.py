@@ -1,51 +1,117 @@
 
-from typing import ByteString, Optional, List, Literal, Sequence
-from itertools import product, combinations
+import sys
+from array import array
+from heapq import heapify, heappop, heappush
+from typing import (
+  ByteString, Callable, Iterable, Optional, List, Literal, Sequence,
+  )
+from itertools import chain, combinations
+from functools import lru_cache
 from PIL import Image
 from copy import copy
 from .memory import read_word
+from . import colorspace
 
 
 __all__ = [
   "Color", "Palette",
   "rect",
   "IndexedTile", "RGBTile",
-  "rip_image",
+  "decode_tiles", "encode_tiles", "flip_tile", "TileIndex",
+  "rip_image", "encode_image", "assign_palettes",
   ]
 
 
+# RGB555 -> RGB888 table, 3 bytes per color.
+_RGB888 = bytes([
+  ((color >> shift) & 0b11111) << 3
+  for color in range(0x8000)
+  for shift in (0, 5, 10)
+  ])
+
+# Interned RGB555 Colors, both by RGB555 value and by RGB888 tuple.
+_colors555 = [None] * 0x8000
+_colors = {}
+
+
 class Color:
-  """A single RGB555 color."""
+  """
+  A single RGB555 color.
+
+  Colors are immutable. The 32768 RGB555 colors are interned: creating
+  one twice gives the same object. Colors made from RGB tuples keep
+  their exact 8-bit channels, and compare equal to RGB555 Colors
+  only if their channels match the RGB555 Color's. Tuples that aren't
+  exactly an RGB555 color make a new Color each time, so importing
+  true-color images doesn't grow the cache.
+  """
+
+  __slots__ = ("r", "g", "b", "color", "_hash")
+
+  def __new__(cls, value=0):
+    # Fast path for RGB tuples that have been seen before.
+    if type(value) is tuple and (c := _colors.get(value)) is not None:
+      return c
+
+    if isinstance(value, Color):
+      return value
+
+    elif isinstance(value, int):
+      value &= 0x7FFF
+      if (c := _colors555[value]) is None:
+        rgb = tuple(_RGB888[value*3:value*3+3])
+        c = _colors555[value] = _colors.setdefault(rgb, cls._make(rgb, value))
+      return c
 
-  def __init__(self, value=0):
-    if isinstance(value, int):
-      self.color = value & 0x7FFF
     elif isinstance(value, Sequence):
       if len(value) != 3:
         raise ValueError(
           f"Length of {repr(value)} must be 3, got {len(value)}."
           )
-      self.r, self.g, self.b = value
-    elif isinstance(value, Color):
-      self.r, self.g, self.b = value.r, value.g, value.b
+      rgb = tuple(value)
+      if (c := _colors.get(rgb)) is not None:
+        return c
+
+      _c = lambda band, shift: (band >> 3) << shift
+      color = _c(rgb[0], 0) | _c(rgb[1], 5) | _c(rgb[2], 10)
+
+      # Only colors that are exactly an RGB555 color are interned,
+      # so the cache never holds more than 32768 Colors.
+      if all([(0 <= band <= 0xFF) and not (band & 0b111) for band in rgb]):
+        return cls(color)
+
+      return cls._make(rgb, color)
+
     else:
       raise ValueError(f"Cannot make Color from object {repr(value)}")
 
-  @property
-  def color(self):
-    _c = lambda band, shift: (band >> 3) << shift
-    return _c(self.r, 0) | _c(self.g, 5) | _c(self.b, 10)
-
-  @color.setter
-  def color(self, value: int):
-    _select = lambda s: ((value & (0b11111 << s)) >> s) << 3
-    self.r, self.g, self.b = [_select(s) for s in range(0, 15, 5)]
+  @classmethod
+  def _make(cls, rgb: tuple, color: int):
+    """Internal helper to create a new, uninterned Color."""
+    c = object.__new__(cls)
+    _set = object.__setattr__
+    _set(c, "r", rgb[0])
+    _set(c, "g", rgb[1])
+    _set(c, "b", rgb[2])
+    _set(c, "color", color)
+    _set(c, "_hash", hash(rgb))
+    return c
+
+  def __setattr__(self, name, value):
+    raise AttributeError("Colors are immutable.")
+
+  def __reduce__(self):
+    return (Color, (self.to_rgb(),))
 
   def __eq__(self, other):
-    return (self.r == other.r) & (self.g == other.g) & (self.b == other.b)
+    if self is other:
+      return True
+    if not isinstance(other, Color):
+      return NotImplemented
+    return (self.r == other.r) and (self.g == other.g) and (self.b == other.b)
 
   def __hash__(self):
-    return hash((self.r, self.b, self.g))
+    return self._hash
 
   def __str__(self):
     return str(self.to_rgb())
@@ -71,59 +137,81 @@ class Color:
     return cls(read_word(data, offset))
 
 
+def _pack(color: Color | Sequence[int]) -> int:
+  """Internal helper to pack a Color or RGB tuple into a 24-bit int."""
+  r, g, b = color.to_rgb() if isinstance(color, Color) else color
+  return (r << 16) | (g << 8) | b
+
+
+def _unpack(value: int) -> Color:
+  """Internal helper to get the Color for a packed 24-bit int."""
+  return Color(((value >> 16) & 0xFF, (value >> 8) & 0xFF, value & 0xFF))
+
+
 class Palette:
-  """A group of Colors."""
+  """
+  A group of Colors.
+
+  Colors are stored as an array of packed RGB values. A reverse map of
+  {packed color: index, ...} is built on first lookup and kept until
+  the Palette changes.
+  """
+
+  __slots__ = ("values", "_index")
 
   def __init__(self, colors=[]):
-    self.current = 0
-    self.colors = [Color(c) for c in colors]
+    self.values = array("I", [_pack(Color(c)) for c in colors])
+    self._index = None
 
-  def __eq__(self):
-    return (self.colors == other.colors)
+  @property
+  def colors(self) -> List[Color]:
+    """A copy of the Palette as a list of Colors."""
+    return [_unpack(v) for v in self.values]
+
+  def __eq__(self, other):
+    if not isinstance(other, Palette):
+      return NotImplemented
+    return (self.values == other.values)
 
   def __hash__(self):
-    return hash(self.colors)
+    return hash(tuple(self.values))
 
   def __iter__(self):
-    return self
-
-  def __next__(self):
-    try:
-      result = self.colors[self.current]
-    except IndexError:
-      self.current = 0
-      raise StopIteration
-    self.current += 1
-    return result
+    return (_unpack(v) for v in self.values)
 
   def __getitem__(self, i: int):
-    return self.colors[i]
+    if isinstance(i, slice):
+      return [_unpack(v) for v in self.values[i]]
+    return _unpack(self.values[i])
 
   def __setitem__(self, i: int, c: Color):
     if not isinstance(c, Color):
       raise ValueError("Palette entries must be Colors.")
-    self.colors[i] = c
+    self.values[i] = _pack(c)
+    self._index = None
 
   def __len__(self):
-    return len(self.colors)
+    return len(self.values)
 
   def __str__(self):
     return str(self.colors)
 
   def __repr__(self):
-    colors = ", ".join([repr(c) for c in self.colors])
+    colors = ", ".join([repr(c) for c in self])
     return f"Palette(colors=[{colors}])"
 
   def __add__(self, other):
     if isinstance(other, Palette):
-      self.colors += other.colors
+      self.values += other.values
+      self._index = None
     else:
       self += Palette(other)
     return self
 
   def __radd__(self, other):
     if isinstance(other, Palette):
-      self.colors = other.colors + self.colors
+      self.values = other.values + self.values
+      self._index = None
     else:
       self = Palette(other) + self
     return self
@@ -131,14 +219,45 @@ class Palette:
   def __iadd__(self, other):
     return self + other
 
+  def insert(self, i: int, c: Color):
+    """Inserts a Color before index `i`."""
+    self.values.insert(i, _pack(Color(c)))
+    self._index = None
+
+  def append(self, c: Color):
+    """Adds a Color to the end of the Palette."""
+    self.values.append(_pack(Color(c)))
+    self._index = None
+
+  def index_of(self, color: Color | Sequence[int]) -> int:
+    """
+    Gets the index of the first occurrence of a Color or RGB tuple.
+    Raises ValueError if the color isn't in the Palette.
+    """
+    if self._index is None:
+      index = {}
+      for (i, v) in enumerate(self.values):
+        index.setdefault(v, i)
+      self._index = index
+    try:
+      return self._index[_pack(color)]
+    except KeyError:
+      raise ValueError(f"{color} is not in the Palette.") from None
+
   def to_bytes(
       self,
       length: Optional[int] = None,
       fillcolor: Color = Color(),
       ) -> ByteString:
     """Converts the Palette into native data."""
-    palette = _fit(self, length, fillcolor)
-    return b"".join([color.to_bytes() for color in palette])
+    values = _fit(self, length, fillcolor)
+    _c = lambda v, shift: ((v >> (shift + 3)) & 0b11111)
+    native = array("H", [
+      _c(v, 16) | (_c(v, 8) << 5) | (_c(v, 0) << 10) for v in values
+      ])
+    if sys.byteorder != "little":
+      native.byteswap()
+    return native.tobytes()
 
   def to_list(
       self,
@@ -146,8 +265,8 @@ class Palette:
       fillcolor: Color = Color(),
       ) -> list:
     """Converts the Palette to a list of RGB tuples."""
-    palette = _fit(self, length, fillcolor)
-    return [color.to_rgb() for color in palette]
+    rgb = _rgb_bytes(_fit(self, length, fillcolor))
+    return list(zip(rgb[0::3], rgb[1::3], rgb[2::3]))
 
   def to_PIL_list(
       self,
@@ -155,11 +274,24 @@ class Palette:
       fillcolor: Color = Color(),
       ) -> list:
     """Converts the Palette to a flat list for use with indexed PIL images."""
-    palette = _fit(self, length, fillcolor)
-    return [b for c in palette for b in c.to_rgb()]
+    return list(_rgb_bytes(_fit(self, length, fillcolor)))
 
+  def nearest_indices(self, colors: Iterable[Sequence[int]]) -> list[int]:
+    """
+    Maps Colors or RGB tuples to the indices of their perceptually
+    closest colors in the Palette, using `colorspace.nearest_indices`.
+    """
+    return colorspace.nearest_indices(
+      (c.to_rgb() if isinstance(c, Color) else c for c in colors),
+      self.to_list(),
+      )
 
-  def requantize(self, length: int, fillcolor: Color=Color()) -> tuple:
+  def requantize(
+      self,
+      length: int,
+      fillcolor: Color = Color(),
+      perceptual: bool = False,
+      ) -> tuple:
     """
     Changes the size of a Palette to a certain length and
     returns a new Palette along with a dictionary of {original:new, ...}
@@ -168,6 +300,8 @@ class Palette:
     the new space is filled with a fillcolor.
     If the new length is less than the original palette, the most
     similar colors are averaged until the desired length is achieved.
+    Colors are compared by brightness, or by OKLab distance
+    if `perceptual` is set.
 
     The first color (the transparent color) is never requantized.
     """
@@ -183,28 +317,25 @@ class Palette:
     elif (length == 1):
       return (Palette(self.colors[0:1]), None)
 
-    colors, remapping = [c.to_rgb() for c in self.colors[1:]], {}
-    while len(colors) > (length - 1):
-      close1, close2 = _get_closest(colors)
-      _avg = lambda c1, c2: (c1 + c2) // 2
-      average = tuple([_avg(close1[i], close2[i]) for i in range(3)])
+    elif (length < 1):
+      raise ValueError(f"Cannot requantize a Palette to {length} colors.")
 
-      colors[colors.index(close1)] = average
-      colors.remove(close2)
-
-      # Add replacement to remapping.
-      remapping[close1] = average
-      remapping[close2] = average
+    colors = [c.to_rgb() for c in self.colors[1:]]
+    distance = colorspace.distance if perceptual else _brightness_distance
+    colors, remapping = _merge_closest(colors, length - 1, distance)
 
     # Flatten remapping such that
     # {original: new1, new1: new2} -> {original: new2}
+    # Merging a color with itself maps it to itself,
+    # so stop at colors that have already been seen.
 
     flat = {}
-    for color in copy(self.colors)[1:]:
+    for color in self.colors[1:]:
       color = color.to_rgb()
-      if color in remapping.keys():
-        new = remapping[color]
-        while new in remapping.keys():
+      if color in remapping:
+        new, seen = remapping[color], {color}
+        while (new in remapping) and (new not in seen):
+          seen.add(new)
           new = remapping[new]
         flat[color] = new
 
@@ -220,8 +351,22 @@ class Palette:
     """Creates a Palette from native data."""
     if count is None:
       count = len(data) // 2
-    c_range = range(offset, offset+(count * 2), 2)
-    return cls([Color.from_bytes(data, i)for i in c_range])
+    if (l := len(data) - offset) < (count * 2):
+      raise ValueError(
+        f"Not enough data to build {count} colors: {l}/{count*2}."
+        )
+    # array() only reinterprets bytes and bytearrays,
+    # so other buffers like memoryviews are copied first.
+    native = array("H")
+    native.frombytes(bytes(data[offset:offset+(count * 2)]))
+    if sys.byteorder != "little":
+      native.byteswap()
+    palette = cls()
+    palette.values = array("I", [
+      int.from_bytes(_RGB888[i:i+3], "big")
+      for i in [(c & 0x7FFF) * 3 for c in native]
+      ])
+    return palette
 
   @classmethod
   def from_image(cls, image: Image, maxlength: Optional[int]=None):
@@ -234,9 +379,9 @@ class Palette:
       return Palette([(p[i], p[i+1], p[i+2]) for i in range(0, len(p), 3)])
 
     elif (image.mode == "RGB"):
-      p = []
-      for c in image.getdata():
-        if c not in p: p.append(c)
+      # dicts keep their insertion order, so this
+      # gets the colors in order of first appearance.
+      p = list(dict.fromkeys(image.getdata()))
       if maxlength is not None:
         p = p[:maxlength]
       return Palette(p)
@@ -251,25 +396,91 @@ def _fit(
     palette: Palette,
     length: Optional[int] = None,
     fillcolor: Color = Color(),
-    ) -> List[Color]:
+    ) -> array:
   """Internal helper to pad or truncate Palettes."""
-  p = copy(palette.colors)
+  p = array("I", palette.values)
   if length is None:
     length = len(p)
   if length > len(p):
-    p.extend([fillcolor for c in range(length - len(p))])
+    p.extend([_pack(fillcolor)] * (length - len(p)))
   return p[:length]
 
 
-def _get_closest(it: Sequence[tuple]) -> tuple:
-  """Internal helper to find the closest two colors in a sequence."""
-  c = list(combinations(it, 2))
-  _diff = lambda l, r: abs(sum(l) - sum(r))
-  closest = (c[0], _diff(c[0][0], c[0][1]))
-  for combo in c:
-    s = _diff(*combo)
-    closest = (combo, s) if (s < closest[1]) else closest
-  return closest[0]
+def _rgb_bytes(values: array) -> bytes:
+  """Internal helper to convert packed colors into RGB bytes."""
+  packed = array("I", values)
+  if sys.byteorder != "little":
+    packed.byteswap()
+  packed = packed.tobytes()
+  rgb = bytearray(len(values) * 3)
+  rgb[0::3], rgb[1::3], rgb[2::3] = packed[2::4], packed[1::4], packed[0::4]
+  return bytes(rgb)
+
+
+def _brightness_distance(l: tuple, r: tuple) -> int:
+  """Internal helper to compare two RGB tuples by brightness."""
+  return abs(sum(l) - sum(r))
+
+
+def _merge_closest(
+    colors: Sequence[tuple],
+    length: int,
+    distance: Callable[[tuple, tuple], float] = _brightness_distance,
+    ) -> tuple:
+  """
+  Internal helper to average the closest pair of colors in a sequence
+  until only `length` colors are left. Returns the remaining colors,
+  in order, and a dict of {original: average, ...} for every merge.
+
+  Pair distances are kept in a heap. Merging a pair changes one color
+  and removes the other, so rather than removing stale pairs, each
+  color has a version that's checked when a pair is popped. Ties go
+  to the earliest pair, and the average takes the earlier color's place.
+  """
+  colors = list(colors)
+  alive = [True] * len(colors)
+  versions = [0] * len(colors)
+
+  heap = [
+    (distance(colors[i], colors[j]), i, j, 0, 0)
+    for (i, j) in combinations(range(len(colors)), 2)
+    ]
+  heapify(heap)
+
+  remapping, count = {}, len(colors)
+  while count > length:
+    _, i, j, version_i, version_j = heappop(heap)
+    if not (alive[i] and alive[j]):
+      continue
+    if (versions[i], versions[j]) != (version_i, version_j):
+      continue
+
+    close1, close2 = colors[i], colors[j]
+    average = tuple([(c1 + c2) // 2 for (c1, c2) in zip(close1, close2)])
+
+    colors[i] = average
+    versions[i] += 1
+    alive[j] = False
+    count -= 1
+
+    # Add replacement to remapping.
+    remapping[close1] = average
+    remapping[close2] = average
+
+    for k in range(len(colors)):
+      if alive[k] and (k != i):
+        a, b = (k, i) if (k < i) else (i, k)
+        heappush(
+          heap,
+          (distance(colors[a], colors[b]), a, b, versions[a], versions[b]),
+          )
+
+  return ([c for (c, a) in zip(colors, alive) if a], remapping)
+
+
+def _isflat(it: Sequence) -> bool:
+  """Internal helper to check whether an iterable has no nested lists."""
+  return not any([isinstance(e, (list, tuple, bytes, bytearray)) for e in it])
 
 
 def _flatten(it: Sequence[int | tuple | List[int | tuple]]):
@@ -289,15 +500,286 @@ def rect(pos: tuple, size: tuple) -> tuple:
 TILEMODE = Literal[2, 4, 8, "rgb"]
 
 
+# Planar tile codec
+
+# Each bitplane is 8 bytes,
+# plane bytes are interwoven into 16-byte groups:
+
+# p0 p1 p0 p1 p0 p1 p0 p1 p0 p1 p0 p1 p0 p1 p0 p1 | 2bpp \      \
+# p2 p3 p2 p3 p2 p3 p2 p3 p2 p3 p2 p3 p2 p3 p2 p3 |      / 4bpp  \
+# p4 p5 p4 p5 p4 p5 p4 p5 p4 p5 p4 p5 p4 p5 p4 p5 |              /
+# p6 p7 p6 p7 p6 p7 p6 p7 p6 p7 p6 p7 p6 p7 p6 p7 |             / 8bpp
+
+# Each byte contains a single bit from each of the
+# row's pixels, with the MSB belonging to the leftmost
+# pixel, LSB to the rightmost.
+
+# A plane byte spread out into a row of eight pixel bytes,
+# each holding that pixel's bit in its lowest bit.
+_SPREAD = [bytes([(b >> (7 - x)) & 1 for x in range(8)]) for b in range(256)]
+
+# The lowest bit of every pixel in a tile.
+_LOW_BITS = b"\x01" * 64
+
+# (shift, mask) pairs that move pixel x's bit from the lowest bit
+# of its own byte to bit 7-x of the first byte in its row.
+_GATHER = [(9 * x - 7, bytes([1 << (7 - x)] + [0] * 7) * 8) for x in range(8)]
+
+# Plane bytes with their bits reversed, which flips a row horizontally.
+_REVERSE = bytes([int(f"{b:08b}"[::-1], 2) for b in range(256)])
+
+
+# Tiles are converted this many at a time, which bounds
+# the size of the cached masks and of the working ints.
+CODEC_CHUNK = 1024
+
+
+@lru_cache(maxsize=8)
+def _codec_masks(bpp: int, count: int) -> tuple:
+  """
+  Internal helper to build the masks used by the tile codec
+  for `count` tiles, each padded to 64 bytes per pair of planes.
+  Returns (low bits mask, [(shift, gather mask), ...]).
+  """
+  pad = bytes(((bpp // 2) - 1) * 64)
+  _mask = lambda tile: int.from_bytes((tile + pad) * count, "little")
+  return (_mask(_LOW_BITS), [(shift, _mask(m)) for (shift, m) in _GATHER])
+
+
+def _chunks(offset: int, count: int, size: int) -> list[tuple[int, int]]:
+  """
+  Internal helper to split `count` tiles of `size` bytes into
+  (offset, count) chunks of at most CODEC_CHUNK tiles.
+  """
+  return [
+    (offset + (i * size), min(CODEC_CHUNK, count - i))
+    for i in range(0, count, CODEC_CHUNK)
+    ]
+
+
+def _decode_chunk(tiles: ByteString, bpp: int, count: int) -> bytes:
+  """Internal helper to decode a chunk of tiles for `decode_tiles`."""
+  groups = bpp // 2
+  low_bits, _ = _codec_masks(bpp, count)
+
+  # Spreading every other byte gives each tile's
+  # planes 0, 2, 4, 6 or 1, 3, 5, 7 in order, 64 pixels each.
+  pixels = 0
+  for low in range(2):
+    rows = b"".join(map(_SPREAD.__getitem__, tiles[low::2]))
+    rows = int.from_bytes(rows, "little")
+    for group in range(groups):
+      pixels |= ((rows >> (group * 512)) & low_bits) << ((group * 2) + low)
+
+  pixels = pixels.to_bytes(count * groups * 64, "little")
+
+  if groups == 1:
+    return pixels
+
+  stride = groups * 64
+  return b"".join([pixels[i:i+64] for i in range(0, len(pixels), stride)])
+
+
+def decode_tiles(
+    data: ByteString,
+    bpp: int,
+    count: Optional[int] = None,
+    offset: int = 0,
+    ) -> bytes:
+  """
+  Converts `count` planar tiles into a flat buffer of pixel indices,
+  64 bytes per tile in row-major order. If `count` isn't given,
+  every whole tile after `offset` is converted.
+
+  Tiles are converted CODEC_CHUNK at a time: every even or odd plane
+  byte is spread into a row of pixel bits using a lookup table, and
+  the planes are merged as a single int.
+  """
+  if bpp not in [2, 4, 8]:
+    raise ValueError(f"Bit depth must be one of [2, 4, 8], not {bpp}.")
+
+  size = bpp * 8
+
+  if count is None:
+    count = max(len(data) - offset, 0) // size
+
+  if (l := len(data) - offset) < (r := (count * size)):
+    raise ValueError(
+      f"Not enough data to build {count} {bpp}bpp tiles: {l}/{r}."
+      )
+
+  return b"".join([
+    _decode_chunk(data[i:i+(n * size)], bpp, n)
+    for (i, n) in _chunks(offset, count, size)
+    ])
+
+
+def _encode_chunk(pixels: ByteString, bpp: int, count: int) -> bytes:
+  """Internal helper to encode a chunk of tiles for `encode_tiles`."""
+  groups = bpp // 2
+  stride = groups * 64
+
+  # Pad each tile so there's room to line up each
+  # pair of planes in the same place as decode_tiles.
+  if groups > 1:
+    pad = bytes(stride - 64)
+    pixels = pad.join([pixels[i:i+64] for i in range(0, len(pixels), 64)]) + pad
+
+  tiles = int.from_bytes(pixels, "little")
+  low_bits, gather = _codec_masks(bpp, count)
+
+  data = bytearray(count * bpp * 8)
+  for low in range(2):
+    rows = 0
+    for group in range(groups):
+      bits = (tiles >> ((group * 2) + low)) & low_bits
+      gathered = 0
+      for (shift, mask) in gather:
+        shifted = (bits >> shift) if (shift >= 0) else (bits << -shift)
+        gathered |= shifted & mask
+      rows |= gathered << (group * 512)
+    data[low::2] = rows.to_bytes(count * stride, "little")[::8]
+
+  return bytes(data)
+
+
+def encode_tiles(pixels: ByteString, bpp: int) -> bytes:
+  """
+  Converts a flat buffer of pixel indices, 64 bytes per tile in
+  row-major order, into planar tiles.
+
+  Tiles are converted CODEC_CHUNK at a time: each plane's bits are
+  gathered into plane bytes by shifting and masking the whole chunk
+  as a single int.
+  """
+  if bpp not in [2, 4, 8]:
+    raise ValueError(f"Bit depth must be one of [2, 4, 8], not {bpp}.")
+
+  count, extra = divmod(len(pixels), 64)
+  if extra:
+    raise ValueError(
+      f"Pixel data must be a multiple of 64 bytes, got {len(pixels)}."
+      )
+
+  return b"".join([
+    _encode_chunk(pixels[i:i+(n * 64)], bpp, n)
+    for (i, n) in _chunks(0, count, 64)
+    ])
+
+
+def flip_tile(
+    data: ByteString,
+    hflip: bool = False,
+    vflip: bool = False,
+    ) -> bytes:
+  """
+  Flips a single planar tile without decoding it. Horizontal flips
+  reverse the bits of every plane byte, vertical flips reverse the
+  order of the rows in each pair of planes.
+  """
+  data = bytes(data)
+  if hflip:
+    data = data.translate(_REVERSE)
+  if vflip:
+    data = b"".join([
+      data[i:i+2]
+      for group in range(0, len(data), 16)
+      for i in range(group + 14, group - 2, -2)
+      ])
+  return data
+
+
+class TileIndex:
+  """
+  A deduplicating index of planar tiles.
+
+  Tiles are added in their native format and each one is mapped to an
+  entry (unique index, hflip, vflip) that reproduces it from the unique
+  tiles. If `flips` is set, all four flips of every unique tile are
+  indexed, so a tile that matches an earlier one up to a flip reuses
+  it. Every tile is hashed once, so indexing is linear in the number
+  of tiles.
+  """
+
+  def __init__(self, bpp: int, flips: bool = True):
+    if bpp not in [2, 4, 8]:
+      raise ValueError(f"Bit depth must be one of [2, 4, 8], not {bpp}.")
+
+    self.bpp = bpp
+    self.flips = flips
+    self.tiles = []
+    self._entries = {}
+
+  def __len__(self):
+    return len(self.tiles)
+
+  def add(self, tile: ByteString) -> tuple[int, bool, bool]:
+    """Adds a planar tile and returns its (index, hflip, vflip) entry."""
+    tile = bytes(tile)
+
+    if len(tile) != (size := (self.bpp * 8)):
+      raise ValueError(
+        f"A {self.bpp}bpp tile must be {size} bytes, got {len(tile)}."
+        )
+
+    if (entry := self._entries.get(tile)) is not None:
+      return entry
+
+    index = len(self.tiles)
+    self.tiles.append(tile)
+
+    # Unflipped tiles come first so that they're preferred
+    # over flips of symmetrical tiles.
+    flips = [(False, False)]
+    if self.flips:
+      flips += [(True, False), (False, True), (True, True)]
+
+    for (hflip, vflip) in flips:
+      flipped = flip_tile(tile, hflip, vflip)
+      self._entries.setdefault(flipped, (index, hflip, vflip))
+
+    return (index, False, False)
+
+  def add_tiles(
+      self,
+      data: ByteString,
+      count: Optional[int] = None,
+      offset: int = 0,
+      ) -> list[tuple[int, bool, bool]]:
+    """
+    Adds `count` planar tiles starting at `offset`, or every whole tile
+    after `offset` if `count` isn't given. Returns their entries.
+    """
+    size = self.bpp * 8
+
+    if count is None:
+      count = max(len(data) - offset, 0) // size
+
+    if (l := len(data) - offset) < (r := (count * size)):
+      raise ValueError(
+        f"Not enough data to index {count} {self.bpp}bpp tiles: {l}/{r}."
+        )
+
+    return [
+      self.add(data[i:i+size])
+      for i in range(offset, offset + (count * size), size)
+      ]
+
+  def to_bytes(self) -> bytes:
+    """Gets the unique tiles as native data."""
+    return b"".join(self.tiles)
+
+
 class TileBase:
   """Base class for Tiles."""
 
+  __slots__ = ("mode", "data")
+
   def __init__(
       self,
       mode: TILEMODE,
       data: Optional[Sequence[int | tuple | Sequence[int | tuple]]] = None,
       ):
-    self.current = 0
     self.mode = mode
 
     if data is None:
@@ -323,22 +805,13 @@ class TileBase:
     return (self.mode == other.mode) & (self.data == other.data)
 
   def __hash__(self):
-    return hash((self.mode, self.data))
+    return hash((self.mode, tuple(self.data)))
 
   def __len__(self):
     return 64
 
   def __iter__(self):
-    return self
-
-  def __next__(self):
-    try:
-      result = self.data[self.current]
-    except IndexError:
-      self.current = 0
-      raise StopIteration
-    self.current += 1
-    return result
+    return iter(self.data)
 
   def __getitem__(self, i):
     return self.data[i]
@@ -357,47 +830,82 @@ class IndexedTile(TileBase):
   """
   A native indexed tile. Pixel data is stored as palette indices.
   Possible bit depths: 2, 4, 8.
+
+  IndexedTiles are immutable: the 64 pixel indices are stored
+  as a single bytes object, which keeps tiles small and lets
+  them be hashed and compared cheaply.
   """
 
+  __slots__ = ()
+
   def __init__(
       self,
       mode: TILEMODE,
-      data: Optional[Sequence[int | Sequence[int]]] = None,
+      data: Optional[ByteString | Sequence[int | Sequence[int]]] = None,
       ):
     if mode not in [2, 4, 8]:
       raise ValueError(
         f"IndexedTile mode must be one of [2, 4, 8], not {mode}."
         )
-    if (data is not None):
-      f = _flatten(data)
-      if not all([isinstance(c, int) for c in f]):
-        raise ValueError("Pixel indices must be ints.")
-      if (max(_flatten(data)) >= (m := (2 ** mode))):
-        raise ValueError(f"Pixel indices must be 0-{m-1} for {mode}bpp Tiles.")
-    super().__init__(mode, data)
 
-  def __setitem__(self, i, c):
-    if not isinstance(c, int):
-      raise ValueError(f"Pixels must be ints for IndexedTiles, got {c}.")
-    elif (c >= (m := (2 ** self.mode))):
+    if data is None:
+      data = bytes(64)
+
+    elif not isinstance(data, bytes):
+      try:
+        data = bytes(data if _isflat(data) else _flatten(data))
+      except TypeError:
+        raise ValueError("Pixel indices must be ints.") from None
+      except ValueError:
+        raise ValueError(
+          f"Pixel indices must be 0-{(2 ** mode) - 1} for {mode}bpp Tiles."
+          ) from None
+
+    if len(data) != 64:
       raise ValueError(
-        f"Pixel indices must be 0-{m-1} for {self.mode}bpp Tiles, got {c}"
+        f"Cannot create Tile from sequence of {len(data)}/64 elements."
         )
-    super().__setitem__(i, c)
+
+    if (mode != 8) and (max(data) >= (m := (2 ** mode))):
+      raise ValueError(f"Pixel indices must be 0-{m-1} for {mode}bpp Tiles.")
+
+    self.mode = mode
+    self.data = data
+
+  def __eq__(self, other):
+    if not isinstance(other, IndexedTile):
+      return NotImplemented
+    return (self.mode == other.mode) and (self.data == other.data)
+
+  def __hash__(self):
+    return hash((self.mode, self.data))
+
+  def __setitem__(self, i, c):
+    raise TypeError("IndexedTiles are immutable.")
+
+  def __str__(self):
+    return str(list(self.data))
+
+  def __repr__(self):
+    return f"IndexedTile(mode={self.mode}, data={list(self.data)})"
+
+  @property
+  def rows(self):
+    return [list(self.data[i:i+8]) for i in range(0, 64, 8)]
 
   def convert(self, mode: TILEMODE, palette: Optional[Palette]=None):
     """
     Converts the Tile to the specified mode and returns the converted Tile.
-    Returns a copy of itself if the requested mode matches the current one.
+    Returns itself if the requested mode matches the current one.
     """
     if self.mode == mode:
-      return copy(self)
+      return self
 
     # For indexed modes, don't do any processing.
     # If the conversion is a reduction in bit depth, this will fail if
     # the palette indices of the original tile are too large.
     elif mode in [2, 4, 8]:
-      return IndexedTile(mode, copy(self.data))
+      return IndexedTile(mode, self.data)
 
     elif mode == "rgb":
 
@@ -420,49 +928,22 @@ class IndexedTile(TileBase):
     Swaps color values according to a dict {original: new}
     and returns a new tile.
     """
-    pixels = copy(self.data)
+    pixels = list(self.data)
     for (i, c) in enumerate(pixels):
       color = oldpalette[c].to_rgb()
       if color in remapping.keys():
         newcolor = remapping[color]
-        newindex = list(newpalette).index(Color(newcolor))
+        newindex = newpalette.index_of(newcolor)
         pixels[i] = newindex
       else:
-        newindex = list(newpalette).index(Color(color))
+        newindex = newpalette.index_of(color)
         pixels[i] = newindex
     t = IndexedTile(self.mode, pixels)
     return t.convert(newmode, newpalette)
 
   def to_bytes(self):
     """Converts the Tile into native data."""
-    bpp, rows = self.mode, self.rows
-
-    # Representing bitplanes as strings of 0s and 1s
-    # because it's easy to convert them into ints.
-    planes = [""] * bpp
-    for row in rows:
-      for pixel in row:
-        for plane in range(bpp):
-          planes[plane] += str((pixel >> plane) & 0b1)
-
-    # Flatten bits into bytes
-    # plane0 [0, 1, 0, 1, 0, 1, 0, 1, ...] -> 55 ...
-    # plane1 [0, 0, 1, 1, 0, 0, 1, 1, ...] -> 33 ...
-    # ...
-    for (p, plane) in enumerate(planes):
-      planes[p] = [
-        int(plane[i:i+8], 2).to_bytes(1, "little") for i in range(0, 64, 8)
-        ]
-
-    # Merge the planes into bytes.
-    # 55 ... -> 55 33
-    # 33 ... -^
-    d = bytearray()
-    for p in range(0, bpp, 2):
-      for i in range(8):
-        d += planes[p][i] + planes[p+1][i]
-
-    return d
+    return encode_tiles(self.data, self.mode)
 
   def to_image(
       self,
@@ -472,52 +953,26 @@ class IndexedTile(TileBase):
       yflip: bool=False,
       ) -> Image:
     """Creates a PIL image from a Tile. Available modes are 'P' or 'RGB'."""
-    rows = self.rows
+    rows = [self.data[i:i+8] for i in range(0, 64, 8)]
     if xflip:
-      for row in rows: row.reverse()
+      rows = [row[::-1] for row in rows]
     if yflip:
       rows.reverse()
+    data = b"".join(rows)
+    im = Image.frombytes("P", (8, 8), data)
+    im.putpalette(palette.to_PIL_list())
     if (mode == "RGB"):
-      data = [palette[c].to_rgb() for c in _flatten(rows)]
-    else:
-      data = _flatten(rows)
-    im = Image.new(mode, (8, 8))
-    im.putdata(data)
-    if (mode == "P"):
-      im.putpalette(palette.to_PIL_list())
+      im = im.convert("RGB")
     return im
 
   @classmethod
   def from_bytes(cls, mode: TILEMODE, data: ByteString, offset: int=0):
     """Creates a tile from native data."""
 
-    if (l := len(data[offset:])) < (r := (mode * 8)):
+    if (l := len(data) - offset) < (r := (mode * 8)):
       raise ValueError(f"Not enough data to build {mode}bpp tile: {l}/{r}.")
 
-    # Each bitplane is 8 bytes,
-    # plane bytes are interwoven into 16-byte groups:
-
-    # p0 p1 p0 p1 p0 p1 p0 p1 p0 p1 p0 p1 p0 p1 p0 p1 | 2bpp \      \
-    # p2 p3 p2 p3 p2 p3 p2 p3 p2 p3 p2 p3 p2 p3 p2 p3 |      / 4bpp  \
-    # p4 p5 p4 p5 p4 p5 p4 p5 p4 p5 p4 p5 p4 p5 p4 p5 |              /
-    # p6 p7 p6 p7 p6 p7 p6 p7 p6 p7 p6 p7 p6 p7 p6 p7 |             / 8bpp
-
-    # Each byte contains a single bit from each of the
-    # row's pixels, with the MSB belonging to the leftmost
-    # pixel, LSB to the rightmost.
-
-    indexes = [[0 for x in range(8)] for y in range(8)]
-    for plane in range(mode):
-      # Get every other byte.
-      p_start = ((plane // 2) * 16) + offset
-      plane_bytes = data[p_start + (plane % 2):p_start + 16:2]
-      for (y, x) in product(range(8), range(8)):
-        # 7 - x to fetch the MSB first.
-        # Add a bit every time we go through the plane.
-        bit = (plane_bytes[y] >> (7 - x)) & 0b1
-        indexes[y][x] += (bit << plane)
-
-    return cls(mode, indexes)
+    return cls(mode, decode_tiles(data, mode, 1, offset))
 
   @classmethod
   def from_image(
@@ -526,8 +981,13 @@ class IndexedTile(TileBase):
       image: Image,
       palette: Optional[Palette] = None,
       pos: tuple = (0, 0),
+      nearest: bool = False,
       ):
-    """Creates a tile from a PIL image."""
+    """
+    Creates a tile from a PIL image. RGB images need a palette. If
+    `nearest` is set, RGB pixels that aren't in the palette are
+    mapped to the perceptually closest palette color.
+    """
 
     crop = image.crop(rect(pos, (8, 8)))
 
@@ -536,10 +996,13 @@ class IndexedTile(TileBase):
         raise ValueError(
           "A palette is required to make an IndexedTile from an RGB image."
           )
-      data = [list(palette).index(Color(c)) for c in list(crop.getdata())]
+      if nearest:
+        data = palette.nearest_indices(crop.getdata())
+      else:
+        data = [palette.index_of(c) for c in crop.getdata()]
 
     elif (image.mode == "P"):
-      data = list(crop.getdata())
+      data = crop.tobytes()
 
     else:
       raise ValueError(f"Image must be mode 'P' or 'RGB', got {image.mode}.")
@@ -552,6 +1015,8 @@ class RGBTile(TileBase):
   An RGB tile. Pixel indices are stored as RGB tuples.
   """
 
+  __slots__ = ()
+
   def __init__(
       self,
       data: Optional[Sequence[tuple | Sequence[tuple]]] = None,
@@ -584,7 +1049,7 @@ class RGBTile(TileBase):
       if palette is None:
         raise ValueError("Converting to an indexed Tile requires a palette.")
 
-      return IndexedTile(mode, [list(palette).index(Color(c)) for c in self])
+      return IndexedTile(mode, [palette.index_of(c) for c in self])
 
     else:
       raise ValueError(f"Unknown mode {mode}.")
@@ -663,27 +1128,283 @@ def rip_image(
     mode: TILEMODE = 4,
     indexed_output = True,
     ):
-  """Rips an image from binary data."""
+  """
+  Rips an image from binary data. Tiles are decoded into a single
+  buffer, rearranged into rows of pixels and handed to PIL at once.
+  RGB images are made by applying the palette to the whole image.
+  """
 
   if mode == "rgb":
     raise ValueError("Mode must be one of [2, 4, 8].")
 
-  im_mode = "P" if indexed_output else "RGB"
-  im = Image.new(im_mode, size)
+  w, h = size
+  columns, rows = -(-w // 8), -(-h // 8)
+  pixels = decode_tiles(data, mode, columns * rows, offset)
 
-  if im_mode == "P":
-    im.putpalette(palette.to_PIL_list())
+  # Each image row takes the same 8 pixel
+  # row from every tile in a row of tiles.
+  starts = [
+    (((ty * columns) + tx) * 64) + (y * 8)
+    for ty in range(rows)
+    for y in range(8)
+    for tx in range(columns)
+    ]
+  lines = [pixels[i:i+8] for i in starts]
 
-  w, h = size
-  for (i, (y, x)) in enumerate(product(range(0, h, 8), range(0, w, 8))):
-    pos = offset + (i * (mode * 8))
-    t = IndexedTile.from_bytes(mode, data, pos)
-    if not indexed_output:
-      t = t.convert("rgb", palette)
-      im.paste(t.to_image(), (x, y))
-    else:
-      im.paste(t.to_image(palette, im_mode), (x, y))
+  im = Image.frombytes("P", (columns * 8, rows * 8), b"".join(lines))
+  im.putpalette(palette.to_PIL_list())
+
+  if (columns * 8, rows * 8) != (w, h):
+    im = im.crop((0, 0, w, h))
+
+  if not indexed_output:
+    im = im.convert("RGB")
 
   return im
 
 
+def encode_image(
+    image: Image,
+    palette: Optional[Palette] = None,
+    mode: TILEMODE = 4,
+    dedup: bool = False,
+    nearest: bool = False,
+    flips: bool = False,
+    ) -> tuple[bytes, list]:
+  """
+  Encodes an image into native tile data, returning the data and a
+  tilemap with the index of each 8x8 tile of the image, in rows.
+
+  Indexed images are used as-is. RGB images need a palette, and each
+  distinct color is looked up once, or mapped to the perceptually
+  closest palette color if `nearest` is set. Images that aren't a
+  multiple of 8 pixels are padded with color 0. If `dedup` is set,
+  repeated tiles are only encoded once. If `flips` is also set, tiles
+  that match up to a flip are merged and the tilemap has
+  (index, hflip, vflip) entries instead.
+  """
+
+  if mode == "rgb":
+    raise ValueError("Mode must be one of [2, 4, 8].")
+
+  if (image.mode == "RGB"):
+    if palette is None:
+      raise ValueError("A palette is required to encode an RGB image.")
+    raw = image.tobytes()
+    rgb = list(zip(raw[0::3], raw[1::3], raw[2::3]))
+    colors = list(dict.fromkeys(rgb))
+    if nearest:
+      indices = palette.nearest_indices(colors)
+    else:
+      indices = [palette.index_of(c) for c in colors]
+    lookup = dict(zip(colors, indices))
+    pixels = bytes(map(lookup.__getitem__, rgb))
+
+  elif (image.mode == "P"):
+    pixels = image.tobytes()
+
+  else:
+    raise ValueError(f"Image must be mode 'P' or 'RGB', got {image.mode}.")
+
+  w, h = image.size
+  columns, rows = -(-w // 8), -(-h // 8)
+  width = columns * 8
+
+  if width != w:
+    pad = bytes(width - w)
+    pixels = b"".join([pixels[i:i+w] + pad for i in range(0, w * h, w)])
+  pixels += bytes(width * ((rows * 8) - h))
+
+  # Each tile takes the same 8 pixels
+  # from 8 consecutive image rows.
+  starts = [
+    (((ty * 8) + y) * width) + (tx * 8)
+    for ty in range(rows)
+    for tx in range(columns)
+    for y in range(8)
+    ]
+  tiles = b"".join([pixels[i:i+8] for i in starts])
+
+  if tiles and (mode != 8) and (max(tiles) >= (m := (2 ** mode))):
+    raise ValueError(f"Pixel indices must be 0-{m-1} for {mode}bpp tiles.")
+
+  data = encode_tiles(tiles, mode)
+
+  if not dedup:
+    return (data, list(range(columns * rows)))
+
+  index = TileIndex(mode, flips)
+  tilemap = index.add_tiles(data)
+
+  if not flips:
+    tilemap = [i for (i, _, _) in tilemap]
+
+  return (index.to_bytes(), tilemap)
+
+
+def _color_usage(groups: dict, choice: dict, count: int) -> list[dict]:
+  """
+  Internal helper to count how many tiles assigned to each
+  of `count` palettes use each color bit.
+  """
+  usage = [{} for i in range(count)]
+  for (mask, weight) in groups.items():
+    usage[choice[mask]] = _with_colors(usage[choice[mask]], mask, weight)
+  return usage
+
+
+def _with_colors(used: dict, mask: int, weight: int) -> dict:
+  """Internal helper to add `weight` tiles using `mask`'s colors to a count."""
+  used = dict(used)
+  while mask:
+    bit = mask & -mask
+    if (n := used.get(bit, 0) + weight):
+      used[bit] = n
+    else:
+      del used[bit]
+    mask ^= bit
+  return used
+
+
+def _usage_loss(used: dict, slots: int) -> int:
+  """
+  Internal helper to count the tile colors lost if a palette
+  keeps only the `slots` most-used colors.
+  """
+  return sum(sorted(used.values(), reverse=True)[slots:])
+
+
+def _best_colors(used: dict, slots: int) -> int:
+  """Internal helper to get the bits of the `slots` most-used colors."""
+  return sum(sorted(used, key=lambda bit: (-used[bit], bit))[:slots])
+
+
+def assign_palettes(
+    image: Image,
+    count: int = 8,
+    length: int = 16,
+    transparent: Optional[Color | Sequence[int]] = None,
+    iterations: int = 16,
+    ) -> tuple[list, list[int], int]:
+  """
+  Builds `count` palettes of `length` colors for an RGB image and
+  assigns each 8x8 tile of the image to one of them, losing as few
+  tile colors as possible.
+
+  The first color of every palette is `transparent`, which defaults
+  to the image's most common color. Each tile's colors are a bitmap
+  over the image's colors, and tiles with the same colors are handled
+  together. They're first assigned greedily, largest color sets first,
+  to the palette that needs the fewest new colors. Then, for up to
+  `iterations` passes, each color set moves to another palette if
+  that loses fewer colors, with every palette keeping the colors its
+  tiles use most.
+
+  Returns the palettes, the palette index of each tile, in rows,
+  and the number of tile colors that didn't fit.
+  """
+
+  if (image.mode != "RGB"):
+    raise ValueError(f"Image must be mode 'RGB', got {image.mode}.")
+
+  w, h = image.size
+  if (w % 8) or (h % 8):
+    raise ValueError(f"Image size must be a multiple of 8, got {w}x{h}.")
+
+  if (count < 1) or (length < 2):
+    raise ValueError(
+      f"Cannot make {count} palettes of {length} colors for an image."
+      )
+
+  raw = image.tobytes()
+  rgb = list(zip(raw[0::3], raw[1::3], raw[2::3]))
+
+  if transparent is None:
+    transparent = max(image.getcolors(w * h))[1]
+  transparent = Color(transparent).to_rgb()
+
+  colors = list(dict.fromkeys(rgb))
+  bits = {c: 1 << i for (i, c) in enumerate(colors)}
+  bits[transparent] = 0
+
+  # Colors are single bits, so the sum of a tile's
+  # distinct color bits is its color set.
+  pixels = list(map(bits.__getitem__, rgb))
+  masks = []
+  for ty in range(0, h, 8):
+    for tx in range(0, w, 8):
+      starts = range((ty * w) + tx, ((ty + 8) * w) + tx, w)
+      masks.append(sum(set(chain.from_iterable(pixels[o:o+8] for o in starts))))
+
+  groups = {}
+  for mask in masks:
+    groups[mask] = groups.get(mask, 0) + 1
+
+  slots = length - 1
+  _missing = lambda mask, s: (mask & ~s).bit_count()
+
+  # Greedy assignment, largest color sets first. Tiles go to the
+  # palette that needs the fewest new colors to fit them, or that's
+  # missing the fewest of their colors if none can fit them.
+  sets = [0] * count
+  choice = {}
+  for mask in sorted(groups, key=lambda m: (-m.bit_count(), -groups[m], m)):
+    best = None
+    for (p, s) in enumerate(sets):
+      if ((union := s | mask).bit_count()) <= slots:
+        key = (0, (union ^ s).bit_count(), p)
+      else:
+        key = (1, _missing(mask, s), p)
+      best = key if (best is None) or (key < best) else best
+
+    p = choice[mask] = best[2]
+    if (union := sets[p] | mask).bit_count() <= slots:
+      sets[p] = union
+
+  usage = _color_usage(groups, choice, count)
+  losses = [_usage_loss(used, slots) for used in usage]
+
+  # Local search: move each color set to the palette that lowers the
+  # total loss the most, with both palettes keeping their most-used
+  # colors, until no move helps.
+  for i in range(iterations):
+    moved = False
+
+    for (mask, weight) in groups.items():
+      old = choice[mask]
+      removed = _with_colors(usage[old], mask, -weight)
+
+      # Adding colors never lowers a palette's loss,
+      # so only tiles whose removal helps can move.
+      if (gain := losses[old] - _usage_loss(removed, slots)) == 0:
+        continue
+
+      best = None
+      for p in range(count):
+        if p == old:
+          continue
+        added = _with_colors(usage[p], mask, weight)
+        cost = _usage_loss(added, slots) - losses[p]
+        if (cost < gain) and ((best is None) or (cost < best[0])):
+          best = (cost, p, added)
+
+      if best is not None:
+        cost, p, added = best
+        choice[mask] = p
+        usage[old], usage[p] = removed, added
+        losses[old] -= gain
+        losses[p] += cost
+        moved = True
+
+    if not moved:
+      break
+
+  sets = [_best_colors(used, slots) for used in usage]
+  loss = sum(losses)
+
+  palettes = []
+  for s in sets:
+    p = [transparent] + [c for c in colors if bits[c] & s]
+    palettes.append(Palette(p + [Color() for i in range(length - len(p))]))
+
+  return (palettes, [choice[mask] for mask in masks], loss)
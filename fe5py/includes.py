@@ -0,0 +1,755 @@
+
+import os
+import re
+import json
+import mmap
+import stat
+import posixpath
+from hashlib import blake2b
+from concurrent.futures import ThreadPoolExecutor
+from typing import ByteString, Callable, Iterable, Iterator, Optional, TextIO
+
+
+__all__ = [
+  "include_types", "binary_types",
+  "get_include", "scan_data", "scan_file",
+  "scan_constants", "evaluate",
+  "DependencyCache", "IncludeGraph", "DependencyWatcher",
+  "build_graph", "write_depfile",
+  ]
+
+
+include_types = [".include", ".binclude"]
+binary_types = [".binary", "binary(", ".crossbank.start *,"]
+
+NOT_FOUND = -1 # For str.find results
+
+CACHE_VERSION = 3
+
+
+def get_include(d: str, s: str) -> Optional[str]:
+  """Tries to find a filename
+  after an include directive.
+  """
+  s = s.replace("'", "\"")
+  start, end = s.find("\""), s.rfind("\"")
+  if start != end:
+    return posixpath.join(d, s[start+1:end])
+  return None
+
+
+def _pattern(tokens: Iterable[str]) -> bytes:
+  """Internal helper to build a regex alternation of literal tokens."""
+  return b"|".join(re.escape(t.encode("UTF-8")) for t in tokens)
+
+
+# Lines that contain none of these can't affect scanning,
+# so they're skipped without ever being split out.
+
+_keywords = [".comment", ".endc"] + include_types + binary_types
+_keyword_re = re.compile(_pattern(_keywords))
+
+# Finds the position of every token in a line. The lookahead
+# lets overlapping tokens, like `.binary` and `binary(`, both match.
+
+_token_re = re.compile(b"(?=(" + _pattern([";"] + _keywords) + b"))")
+
+_directives = [(t.encode("UTF-8"), t) for t in include_types + binary_types]
+
+
+def scan_data(
+    data: ByteString,
+    d: str,
+    expressions: Optional[list] = None,
+    ) -> list[tuple[str, str]]:
+  """
+  Scans 64tass source for include directives. `data` may be any bytes-like
+  object, including a memory-mapped file. Returns a list of
+  (path, directive) for each include, with paths relative to `d`.
+  Does not follow the includes it finds.
+
+  If an `expressions` list is given, includes whose filename isn't a
+  plain string are appended to it as (expression, directive, fallback,
+  index) instead, where `fallback` is the path that would have been
+  used otherwise and `index` is where it belongs in the returned list.
+  """
+
+  # Issues:
+  # Missing/unclosed directives will
+  # ruin scanning until nesting level returns
+  # to zero.
+
+  found = []
+
+  comment_nesting_level = 0
+
+  pos = 0
+  while (m := _keyword_re.search(data, pos)) is not None:
+
+    start = data.rfind(b"\n", 0, m.start()) + 1
+    end = data.find(b"\n", m.end())
+    end = len(data) if end == NOT_FOUND else end
+    pos = end
+
+    line = data[start:end]
+
+    # Only the first of each token
+    # in a line matters.
+    first = {}
+    for t in _token_re.finditer(line):
+      first.setdefault(t.group(1), t.start())
+
+    comment_pos = first.get(b";", NOT_FOUND)
+    block_comment_pos = first.get(b".comment", NOT_FOUND)
+
+    # If block comment directive exists
+    # and is before any possible line comments.
+
+    if block_comment_pos != NOT_FOUND:
+      if (comment_pos == NOT_FOUND) or (comment_pos > block_comment_pos):
+        comment_nesting_level += 1
+        continue
+
+    # If we're in a comment block, scan
+    # for the end of the block rather
+    # than for includes.
+
+    if comment_nesting_level > 0:
+      block_end_pos = first.get(b".endc", NOT_FOUND) # .endcomment too
+
+      if block_end_pos != NOT_FOUND:
+        if (comment_pos == NOT_FOUND) or (comment_pos > block_end_pos):
+          comment_nesting_level -= 1
+
+      # Line still gets ignored
+      continue
+
+    for (token, inc_type) in _directives:
+      inc_pos = first.get(token, NOT_FOUND)
+
+      if inc_pos == NOT_FOUND:
+        continue
+
+      # Commented-out includes
+      if (comment_pos != NOT_FOUND) and (inc_pos > comment_pos):
+        continue
+
+      # Try to get a valid path
+      # from include
+      p = get_include(d, line[inc_pos:].decode("UTF-8"))
+
+      # Filenames built from constants are
+      # resolved once all constants are known.
+      if expressions is not None:
+        arg = _argument(line[inc_pos+len(token):].decode("UTF-8"))
+        if arg and not _literal_re.fullmatch(arg):
+          fallback = posixpath.normpath(p) if p else None
+          expressions.append((arg, inc_type, fallback, len(found)))
+          continue
+
+      if not p:
+        continue
+
+      found.append((posixpath.normpath(p), inc_type))
+
+  return found
+
+
+def _argument(s: str) -> str:
+  """
+  Internal helper to get the first argument of a directive, which ends
+  at a top-level comma, an unmatched closing parenthesis or a comment.
+  """
+  depth, quote = 0, None
+  for (i, c) in enumerate(s):
+    if quote is not None:
+      if c == quote:
+        quote = None
+    elif c in "\"'":
+      quote = c
+    elif c == "(":
+      depth += 1
+    elif (c == ")") and (depth > 0):
+      depth -= 1
+    elif (c in ",;)") and (depth == 0):
+      return s[:i].strip()
+  return s.strip()
+
+
+# Constant expressions
+
+# Only a small subset of 64tass expressions is supported:
+# strings, numbers, names of other constants, `..` concatenation,
+# parentheses and format().
+
+_literal_re = re.compile(r"\"[^\"]*\"|'[^']*'")
+
+_expression_token_re = re.compile(r"""\s*(?:
+  (?P<string>"[^"]*"|'[^']*')
+  |(?P<number>\$[0-9A-Fa-f]+|%[01]+|[0-9]+)
+  |(?P<concat>\.\.)
+  |(?P<name>[A-Za-z_]\w*(?:\.[A-Za-z_]\w*)*)
+  |(?P<punctuation>[(),])
+  )""", re.X)
+
+_constant_re = re.compile(rb"""
+  ^[ \t]*([A-Za-z_]\w*(?:\.[A-Za-z_]\w*)*)  # name
+  [ \t]*:?=(?!=)[ \t]*
+  ([^;\r\n]*)                             # value
+  """, re.M | re.X)
+
+
+class _Unresolved(Exception):
+  """Internal exception for expressions that can't be evaluated."""
+
+
+def _tokenize(text: str) -> Optional[list[tuple[str, str]]]:
+  """Internal helper to split an expression into (kind, text) tokens."""
+  text, tokens, pos = text.rstrip(), [], 0
+  while pos < len(text):
+    if (m := _expression_token_re.match(text, pos)) is None:
+      return None
+    tokens.append((m.lastgroup, m.group(m.lastgroup)))
+    pos = m.end()
+  return tokens if tokens else None
+
+
+def evaluate(
+    text: str,
+    lookup: Callable[[str], Optional[str | int]],
+    ) -> Optional[str | int]:
+  """
+  Evaluates a simple constant expression, using `lookup` to get the
+  values of names. Returns None if the expression can't be evaluated.
+  """
+  if (tokens := _tokenize(text)) is None:
+    return None
+
+  pos = 0
+
+  def _peek():
+    return tokens[pos][1] if pos < len(tokens) else None
+
+  def _next():
+    nonlocal pos
+    if pos >= len(tokens):
+      raise _Unresolved
+    pos += 1
+    return tokens[pos-1]
+
+  def _expect(value):
+    if _next()[1] != value:
+      raise _Unresolved
+
+  def _expression():
+    value = _term()
+    while _peek() == "..":
+      _next()
+      right = _term()
+      if not (isinstance(value, str) and isinstance(right, str)):
+        raise _Unresolved
+      value += right
+    return value
+
+  def _term():
+    kind, value = _next()
+    match kind:
+
+      case "string":
+        return value[1:-1]
+
+      case "number":
+        if value.startswith("$"):
+          return int(value[1:], 16)
+        elif value.startswith("%"):
+          return int(value[1:], 2)
+        return int(value)
+
+      case "name" if (value == "format") and (_peek() == "("):
+        _next()
+        args = [_expression()]
+        while _peek() == ",":
+          _next()
+          args.append(_expression())
+        _expect(")")
+        if not isinstance(args[0], str):
+          raise _Unresolved
+        try:
+          return args[0] % tuple(args[1:])
+        except (TypeError, ValueError):
+          raise _Unresolved
+
+      case "name":
+        if (result := lookup(value)) is None:
+          raise _Unresolved
+        return result
+
+      case "punctuation" if value == "(":
+        result = _expression()
+        _expect(")")
+        return result
+
+    raise _Unresolved
+
+  try:
+    value = _expression()
+  except _Unresolved:
+    return None
+
+  return value if pos == len(tokens) else None
+
+
+def scan_constants(data: ByteString) -> dict[str, str]:
+  """
+  Finds simple constant definitions like `NAME = "path"` in 64tass
+  source. Returns a {name: expression, ...} dict, keeping the first
+  definition of each name. Definitions inside `.comment` blocks
+  aren't skipped.
+  """
+  constants = {}
+  for m in _constant_re.finditer(data):
+    value = m.group(2).decode("UTF-8").strip()
+    if _tokenize(value) is not None:
+      constants.setdefault(m.group(1).decode("UTF-8"), value)
+  return constants
+
+
+def _resolver(
+    own: dict[str, str],
+    shared: dict[str, str],
+    ) -> Callable[[str], Optional[str | int]]:
+  """
+  Internal helper to make a lookup function for `evaluate` that prefers
+  a file's own constants over ones defined elsewhere.
+  """
+  values, active = {}, set()
+
+  def lookup(name):
+    if name in values:
+      return values[name]
+    text = own.get(name, shared.get(name))
+    if (text is None) or (name in active):
+      return None
+    active.add(name)
+    values[name] = evaluate(text, lookup)
+    active.discard(name)
+    return values[name]
+
+  return lookup
+
+
+def _read(file: str) -> bytes:
+  """Internal helper to read a source file."""
+  with open(file, "rb") as i:
+    return i.read()
+
+
+def _hash(data: bytes) -> str:
+  """Internal helper to hash a source file's contents."""
+  return blake2b(data, digest_size=16).hexdigest()
+
+
+def scan_file(
+    file: str,
+    data: Optional[ByteString] = None,
+    expressions: Optional[list] = None,
+    ) -> list[tuple[str, str]]:
+  """
+  Scans a single file for include directives. Returns a list of
+  (path, directive) for each include. Does not follow the includes.
+  If `data` isn't given, the file is memory-mapped rather than read.
+  See `scan_data` for `expressions`.
+  """
+  d = posixpath.dirname(file)
+
+  if data is not None:
+    return scan_data(data, d, expressions)
+
+  with open(file, "rb") as i:
+    if os.fstat(i.fileno()).st_size == 0:
+      return []
+    with mmap.mmap(i.fileno(), 0, access=mmap.ACCESS_READ) as m:
+      return scan_data(m, d, expressions)
+
+
+class DependencyCache:
+  """
+  A persistent cache of each file's direct includes.
+
+  Entries are keyed by path and validated by the file's size and
+  modification time. If those change, the file's contents are hashed
+  and only rescanned if the hash differs from the cached one.
+  """
+
+  def __init__(self, filename: Optional[str] = None):
+    self.filename = filename
+    self.files = {}
+    self.dirty = False
+
+    if filename is not None:
+      self.load()
+
+  def load(self):
+    """Loads the cache file, ignoring it if it is missing or invalid."""
+    try:
+      with open(self.filename, "r", encoding="UTF-8") as i:
+        cache = json.load(i)
+    except (OSError, ValueError):
+      return
+
+    if isinstance(cache, dict) and (cache.get("version") == CACHE_VERSION):
+      self.files = cache.get("files", {})
+
+  def save(self):
+    """Saves the cache file if anything has changed."""
+    if (self.filename is None) or not self.dirty:
+      return
+
+    temp = self.filename + ".tmp"
+    with open(temp, "w", encoding="UTF-8") as o:
+      json.dump({"version": CACHE_VERSION, "files": self.files}, o)
+    os.replace(temp, self.filename)
+
+    self.dirty = False
+
+  def scan(self, file: str) -> tuple[list, dict, list]:
+    """
+    Gets a file's direct includes, constants and unresolved include
+    expressions, rescanning the file only if it has changed.
+    See `scan_data` and `scan_constants`. Missing files have no includes.
+    """
+    try:
+      s = os.stat(file)
+    except OSError:
+      return ([], {}, [])
+
+    if not stat.S_ISREG(s.st_mode):
+      return ([], {}, [])
+
+    entry = self.files.get(file)
+
+    if entry is not None:
+      if (entry["mtime"], entry["size"]) == (s.st_mtime_ns, s.st_size):
+        return _unpack(entry)
+
+    data = _read(file)
+    digest = _hash(data)
+
+    if (entry is not None) and (entry["hash"] == digest):
+      found, constants, expressions = _unpack(entry)
+    else:
+      expressions = []
+      found = scan_file(file, data, expressions)
+      constants = scan_constants(data)
+
+    self.files[file] = {
+      "mtime": s.st_mtime_ns,
+      "size": s.st_size,
+      "hash": digest,
+      "includes": found,
+      "constants": constants,
+      "expressions": expressions,
+      }
+    self.dirty = True
+
+    return (found, constants, expressions)
+
+
+def _unpack(entry: dict) -> tuple[list, dict, list]:
+  """Internal helper to get the scan results from a cache entry."""
+  return (
+    [tuple(inc) for inc in entry["includes"]],
+    entry["constants"],
+    [tuple(e) for e in entry["expressions"]],
+    )
+
+
+class IncludeGraph:
+  """
+  A graph of 64tass source files and the files they include.
+
+  `edges` is a dict of {file: [(path, directive), ...], ...} for every
+  scanned file. Binary includes are leaves and have no entry of their
+  own, and missing files have no includes.
+
+  `scans` holds each scanned file's results from `DependencyCache.scan`,
+  which are used to resolve includes that are built from constants.
+  Constants are shared between all files in the graph, but a file's
+  own constants are preferred.
+  """
+
+  def __init__(
+      self,
+      edges: Optional[dict] = None,
+      scans: Optional[dict] = None,
+      ):
+    self.edges = edges if edges is not None else {}
+    self.scans = scans if scans is not None else {}
+
+  def __len__(self):
+    return len(self.nodes)
+
+  def __contains__(self, file: str):
+    return file in self.nodes
+
+  @property
+  def nodes(self) -> set:
+    """Every file in the graph, including leaves."""
+    return set(self.edges) | {p for e in self.edges.values() for (p, _) in e}
+
+  def constants(self) -> dict[str, str]:
+    """Gets every constant in the graph, keeping the first definitions."""
+    constants = {}
+    for (_, found, _) in self.scans.values():
+      for (name, value) in found.items():
+        constants.setdefault(name, value)
+    return constants
+
+  def resolve(self, file: str, constants: dict[str, str]) -> list:
+    """
+    Gets a scanned file's includes, evaluating any filenames that
+    are built from constants.
+    """
+    includes, own, expressions = self.scans[file]
+
+    lookup = _resolver(own, constants)
+    d = posixpath.dirname(file)
+
+    # Inserting from the back keeps the
+    # earlier indices valid.
+    edges = list(includes)
+    for (arg, directive, fallback, index) in reversed(expressions):
+      if isinstance(value := evaluate(arg, lookup), str):
+        p = posixpath.normpath(posixpath.join(d, value))
+      elif fallback is not None:
+        p = fallback
+      else:
+        continue
+      edges.insert(index, (p, directive))
+
+    return edges
+
+  def remove(self, file: str):
+    """Removes a scanned file from the graph so that it can be rescanned."""
+    self.edges.pop(file, None)
+    self.scans.pop(file, None)
+
+  def closure(self, files: Iterable[str]) -> Iterator[str]:
+    """
+    Yields every file included by the given files, following includes
+    of included files. Binary includes are not followed. Each file
+    is only yielded once.
+    """
+    scanned = set()
+
+    def _scan(file):
+      for (p, directive) in self.edges.get(file, []):
+        if p not in scanned:
+          scanned.add(p)
+          yield p
+
+          # Check if that file has any
+          # includes
+          if directive not in binary_types:
+            yield from _scan(p)
+
+    for file in files:
+      yield from _scan(file)
+
+  def dependents(self, file: str) -> set:
+    """Gets the set of files that directly include a file."""
+    return {
+      f for (f, includes) in self.edges.items()
+      if any(p == file for (p, _) in includes)
+      }
+
+  def reverse(self) -> dict:
+    """Gets a {path: {file that includes it, ...}, ...} dict."""
+    reverse = {}
+    for (file, includes) in self.edges.items():
+      for (p, _) in includes:
+        reverse.setdefault(p, set()).add(file)
+    return reverse
+
+  def ancestors(
+      self,
+      files: Iterable[str],
+      reverse: Optional[dict] = None,
+      ) -> set:
+    """
+    Gets the set of files that include any of the given files, directly
+    or through other files. `reverse` may be a precomputed `reverse()`.
+    """
+    if reverse is None:
+      reverse = self.reverse()
+
+    found, frontier = set(), list(files)
+    while frontier:
+      for f in reverse.get(frontier.pop(), ()):
+        if f not in found:
+          found.add(f)
+          frontier.append(f)
+
+    return found
+
+
+def build_graph(
+    files: Iterable[str],
+    cache: Optional[DependencyCache] = None,
+    jobs: Optional[int] = None,
+    graph: Optional[IncludeGraph] = None,
+    ) -> IncludeGraph:
+  """
+  Builds the include graph for a set of files, reading each file
+  once on a pool of `jobs` threads. If an existing `graph` is given,
+  it is extended and files already in it aren't rescanned.
+  """
+  if cache is None:
+    cache = DependencyCache()
+
+  if graph is None:
+    graph = IncludeGraph()
+
+  frontier = [f for f in dict.fromkeys(files) if f not in graph.edges]
+  seen = set(frontier) | set(graph.edges)
+
+  def _follow(includes):
+    for (p, directive) in includes:
+      if (directive not in binary_types) and (p not in seen):
+        seen.add(p)
+        frontier.append(p)
+
+  # Each round scans every file found by the previous
+  # round, so shared files are only read once.
+
+  with ThreadPoolExecutor(jobs) as pool:
+    while frontier:
+
+      while frontier:
+        batch, frontier = frontier, []
+        for (file, scan) in zip(batch, pool.map(cache.scan, batch)):
+          graph.scans[file] = scan
+          graph.edges[file] = scan[0]
+          _follow(scan[0])
+
+      # Constants can be defined in any file, so includes
+      # built from them are resolved once everything
+      # reachable has been scanned. Newly resolved
+      # includes may lead to more files to scan.
+
+      constants = graph.constants()
+      for (file, scan) in graph.scans.items():
+        if scan[2]:
+          graph.edges[file] = graph.resolve(file, constants)
+          _follow(graph.edges[file])
+
+  return graph
+
+
+def _stat_key(file: str) -> Optional[tuple[int, int]]:
+  """Internal helper to get a file's (mtime, size), or None if missing."""
+  try:
+    s = os.stat(file)
+  except OSError:
+    return None
+  return (s.st_mtime_ns, s.st_size)
+
+
+class DependencyWatcher:
+  """
+  Keeps the include graph for a set of top-level files in memory and
+  updates it as files change.
+
+  Changes are found by polling the modification time and size
+  of every file in the graph.
+  """
+
+  def __init__(
+      self,
+      roots: Iterable[str],
+      cache: Optional[DependencyCache] = None,
+      jobs: Optional[int] = None,
+      ):
+    self.roots = list(dict.fromkeys(roots))
+    self.cache = cache if cache is not None else DependencyCache()
+    self.jobs = jobs
+    self.graph = build_graph(self.roots, self.cache, jobs)
+    self._reverse = self.graph.reverse()
+    self.stats = {f: _stat_key(f) for f in self._files()}
+
+  def _files(self) -> set:
+    """Internal helper to get every file being watched."""
+    return set(self.roots) | self.graph.nodes
+
+  def dependencies(self, file: str) -> list[str]:
+    """Gets every file that a file includes, directly or indirectly."""
+    return list(self.graph.closure([file]))
+
+  def dependents(self, file: str) -> set:
+    """Gets every file that includes a file, directly or indirectly."""
+    return self.graph.ancestors([file], self._reverse)
+
+  def targets(self, files: Iterable[str]) -> list[str]:
+    """Gets the top-level files that depend on any of the given files."""
+    files = set(files)
+    affected = files | self.graph.ancestors(files, self._reverse)
+    return [r for r in self.roots if r in affected]
+
+  def poll(self) -> set:
+    """
+    Checks every watched file for changes, rescanning only the source
+    files that changed. Returns the set of files that changed.
+    """
+    changed = set()
+    for (file, old) in self.stats.items():
+      if (new := _stat_key(file)) != old:
+        self.stats[file] = new
+        changed.add(file)
+
+    if not changed:
+      return changed
+
+    rescan = [f for f in changed if f in self.graph.edges]
+
+    for file in rescan:
+      self.graph.remove(file)
+
+    # A changed constant can change includes in other
+    # files, so the reverse map is rebuilt afterwards.
+    build_graph(rescan, self.cache, self.jobs, self.graph)
+    self._reverse = self.graph.reverse()
+
+    # Files that are new to the graph get scanned
+    # along with the files that changed.
+    for file in self._files() - set(self.stats):
+      self.stats[file] = _stat_key(file)
+
+    return changed
+
+
+def _make_escape(path: str) -> str:
+  """Internal helper to escape a path for use in a Makefile."""
+  return path.replace("$", "$$").replace("#", "\\#").replace(" ", "\\ ")
+
+
+def write_depfile(
+    target: str,
+    deps: Iterable[str],
+    o: TextIO,
+    source: Optional[str] = None,
+    ):
+  """
+  Writes a Make depfile for a target. The `source` file, if given, is
+  listed first. Each other dependency also gets an empty phony rule, so
+  that Make doesn't fail when a dependency is deleted, like `gcc -MP`.
+  """
+  deps = [_make_escape(d) for d in deps]
+  main = [] if source is None else [_make_escape(source)]
+
+  o.write(_make_escape(target) + ":")
+  for d in main + deps:
+    o.write(f" \\\n  {d}")
+  o.write("\n")
+
+  for d in deps:
+    o.write(f"\n{d}:\n")
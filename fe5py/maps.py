@@ -6,6 +6,7 @@ from itertools import product
 import tmx
 from .memory import read_byte, read_word
 from .graphics import Color, Palette, IndexedTile, rect
+from .graphics import decode_tiles, encode_tiles, TileIndex, assign_palettes
 
 
 terrain_types = {
@@ -127,10 +128,8 @@ class MapTileset:
       ):
     """Creates a MapTileset from native data."""
 
-    tiles = [
-      IndexedTile.from_bytes(4, tiledata, offset)
-      for offset in range(0, (16 * 40) * 32, 32)
-      ]
+    pixels = decode_tiles(tiledata, 4, 16 * 40)
+    tiles = [IndexedTile(4, pixels[i:i+64]) for i in range(0, len(pixels), 64)]
 
     tilemap = [[tmx.LayerTile(0) for x in range(64)] for y in range(64)]
 
@@ -243,6 +242,106 @@ class MapTileset:
     ts = MapTileset(basename, tiles, config, terrains, palette)
     ts.to_tmx(os.path.join(dirname, basename+".tmx"))
 
+  def deduplicate(self) -> int:
+    """
+    Merges tiles that are the same up to a flip, updating the config
+    to use flipped copies of the remaining tiles. The freed tiles are
+    blanked at the end of the tileset. Returns the number of unique tiles.
+    """
+
+    count = len(self.tiles)
+
+    index = TileIndex(4)
+    entries = index.add_tiles(
+      encode_tiles(b"".join([tile.data for tile in self.tiles]), 4)
+      )
+
+    pixels = decode_tiles(index.to_bytes(), 4)
+    tiles = [IndexedTile(4, pixels[i:i+64]) for i in range(0, len(pixels), 64)]
+    self.tiles = tiles + [IndexedTile(4) for i in range(count - len(tiles))]
+
+    config = []
+    for tile in self.config:
+
+      if tile.gid == 0:
+        config.append(tile)
+        continue
+
+      # Flips commute, so flipping a flipped tile
+      # just toggles the tile's own flips.
+      pal, old = divmod(tile.gid - 1, 640)
+      new, hflip, vflip = entries[old]
+
+      config.append(tmx.LayerTile(
+        1 + (640 * pal) + new,
+        tile.hflip != hflip,
+        tile.vflip != vflip,
+        tile.dflip,
+        ))
+
+    self.config = config
+
+    return len(tiles)
+
+  def import_image(
+      self,
+      image: Image,
+      transparent: Optional[Color] = None,
+      ) -> int:
+    """
+    Replaces the MapTileset's palettes, tiles and config with a 512x512
+    RGB image laid out like `to_image`. Each 8x8 tile is assigned one
+    of the 8 palettes by `assign_palettes`, colors that don't fit are
+    replaced by the closest palette color and tiles that are the same
+    up to a flip are merged. Returns the number of tile colors that
+    didn't fit in their palette.
+    """
+
+    if image.size != (512, 512):
+      raise ValueError(f"Tileset image must be 512x512, got {image.size}.")
+
+    image = image.convert("RGB")
+
+    palettes, assignment, lost = assign_palettes(image, 8, 16, transparent)
+
+    raw = image.tobytes()
+    rgb = list(zip(raw[0::3], raw[1::3], raw[2::3]))
+
+    # Exact colors map to their first index, the closest
+    # colors are looked up for anything else as needed.
+    lookups = [
+      {c: i for (i, c) in reversed(list(enumerate(p.to_list())))}
+      for p in palettes
+      ]
+
+    pixels = bytearray()
+    for (i, (y, x)) in enumerate(product(range(0, 512, 8), repeat=2)):
+      pal = assignment[i]
+      lookup = lookups[pal]
+      for row in range(y, y + 8):
+        line = rgb[(row * 512) + x:(row * 512) + x + 8]
+        if (missing := [c for c in set(line) if c not in lookup]):
+          lookup.update(zip(missing, palettes[pal].nearest_indices(missing)))
+        pixels.extend(map(lookup.__getitem__, line))
+
+    index = TileIndex(4)
+    entries = index.add_tiles(encode_tiles(pixels, 4))
+
+    if (l := len(index)) > 640:
+      raise ValueError(f"Tileset image needs {l} unique tiles, only 640 fit.")
+
+    pixels = decode_tiles(index.to_bytes(), 4)
+    tiles = [IndexedTile(4, pixels[i:i+64]) for i in range(0, len(pixels), 64)]
+
+    self.tiles = tiles + [IndexedTile(4) for i in range(640 - len(tiles))]
+    self.palette = palettes
+    self.config = [
+      tmx.LayerTile(1 + (640 * pal) + t_index, hflip, vflip)
+      for (pal, (t_index, hflip, vflip)) in zip(assignment, entries)
+      ]
+
+    return lost
+
   def to_image(self) -> Image:
     """Returns the MapTileset as an image usable as a Tiled tileset."""
 
@@ -353,7 +452,7 @@ class MapTileset:
 
     config += terrains
 
-    tiles = b"".join([tile.to_bytes() for tile in self.tiles])
+    tiles = encode_tiles(b"".join([tile.data for tile in self.tiles]), 4)
 
     palette = b"".join([pal.to_bytes(16) for pal in self.palette])
 
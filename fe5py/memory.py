@@ -1,11 +1,12 @@
 
-from typing import ByteString
+from typing import ByteString, Optional
 
 
 __all__ = [
   "read_byte", "read_word", "read_long",
   "read_byte_range", "read_word_range", "read_long_range",
   "lorom", "unlorom",
+  "checksum", "fix_checksum",
   ]
 
 
@@ -93,3 +94,39 @@ def unlorom(address: int) -> int:
   offset = address & 0x7FFF
   return (bank << 15) | offset
 
+
+
+# SNES header
+
+
+CHECKSUM_COMPLEMENT = 0x7FDC
+CHECKSUM = 0x7FDE
+
+
+def checksum(data: ByteString) -> int:
+  """Calculates the SNES checksum of a LoROM image."""
+  return sum(memoryview(data)) & 0xFFFF
+
+
+def fix_checksum(data: ByteString) -> Optional[tuple[int, int]]:
+  """
+  Writes a new checksum and complement into a LoROM image if they
+  differ from the ones in its header. Returns the new (checksum, complement)
+  or None if the header was already correct.
+  """
+  if len(data) < CHECKSUM + 2:
+    raise ValueError("Data is too small to contain a SNES header.")
+
+  oldsum = read_word(data, CHECKSUM)
+
+  new = checksum(data)
+  complement = (new ^ 0xFFFF) & 0xFFFF
+
+  if new == oldsum:
+    return None
+
+  c, s = CHECKSUM_COMPLEMENT, CHECKSUM
+  data[c:c+2] = complement.to_bytes(2, "little")
+  data[s:s+2] = new.to_bytes(2, "little")
+
+  return (new, complement)
@@ -0,0 +1,231 @@
+
+from typing import ByteString
+from zlib import crc32
+
+
+__all__ = [
+  "patch_size", "apply_patch",
+  "apply_ips", "apply_bps",
+  ]
+
+
+IPS_MAGIC = b"PATCH"
+IPS_EOF = b"EOF"
+BPS_MAGIC = b"BPS1"
+
+
+# IPS
+
+
+def _ips_records(patch: ByteString):
+  """
+  Internal helper that walks an IPS patch. Yields (offset, length, data, rle)
+  for each record, where `data` is either a slice of the patch or, for RLE
+  records, the single repeated byte. Returns the truncation size, if any.
+  """
+  if patch[:5] != IPS_MAGIC:
+    raise ValueError("Not an IPS patch.")
+
+  pos, end = 5, len(patch)
+
+  while pos + 3 <= end:
+
+    if patch[pos:pos+3] == IPS_EOF:
+      pos += 3
+      if pos + 3 <= end:
+        return int.from_bytes(patch[pos:pos+3], "big")
+      return None
+
+    if pos + 5 > end:
+      break
+
+    offset = int.from_bytes(patch[pos:pos+3], "big")
+    size = int.from_bytes(patch[pos+3:pos+5], "big")
+    pos += 5
+
+    if size == 0:
+      if pos + 3 > end:
+        raise ValueError(
+          f"IPS patch is truncated: RLE record at ${offset:06X}.")
+      size = int.from_bytes(patch[pos:pos+2], "big")
+      yield (offset, size, patch[pos+2], True)
+      pos += 3
+
+    else:
+      if pos + size > end:
+        raise ValueError(f"IPS patch is truncated: record at ${offset:06X}.")
+      yield (offset, size, patch[pos:pos+size], False)
+      pos += size
+
+  raise ValueError("IPS patch is missing its EOF marker.")
+
+
+def _ips_size(patch: ByteString, source_size: int) -> int:
+  """Internal helper to get the size of an IPS patch's output."""
+  records = _ips_records(patch)
+  size = source_size
+  try:
+    while True:
+      offset, length, _, _ = next(records)
+      size = max(size, offset + length)
+  except StopIteration as truncate:
+    if truncate.value is not None:
+      size = truncate.value
+  return size
+
+
+def apply_ips(patch: ByteString, source: ByteString, target: ByteString):
+  """
+  Applies an IPS patch. `target` must be a writable buffer that is
+  `patch_size()` bytes long, and may be `source` itself.
+  """
+  if target is not source:
+    size = min(len(source), len(target))
+    target[:size] = source[:size]
+
+  end = len(target)
+  for (offset, length, data, rle) in _ips_records(patch):
+    # Records past a truncation point are dropped.
+    length = min(length, end - offset)
+    if length <= 0:
+      continue
+    if rle:
+      target[offset:offset+length] = bytes([data]) * length
+    else:
+      target[offset:offset+length] = data[:length]
+
+
+# BPS
+
+
+def _bps_number(patch: ByteString, pos: int) -> tuple[int, int]:
+  """Internal helper to read a BPS variable-length number."""
+  data, shift = 0, 1
+  while True:
+    if pos >= len(patch):
+      raise ValueError("BPS patch is truncated.")
+    x = patch[pos]
+    pos += 1
+    data += (x & 0x7F) * shift
+    if x & 0x80:
+      return (data, pos)
+    shift <<= 7
+    data += shift
+
+
+def _bps_header(patch: ByteString) -> tuple[int, int, int]:
+  """
+  Internal helper to read a BPS header.
+  Returns (source size, target size, offset of the first action).
+  """
+  if patch[:4] != BPS_MAGIC:
+    raise ValueError("Not a BPS patch.")
+  source_size, pos = _bps_number(patch, 4)
+  target_size, pos = _bps_number(patch, pos)
+  metadata_size, pos = _bps_number(patch, pos)
+  return (source_size, target_size, pos + metadata_size)
+
+
+def _bps_signed(value: int) -> int:
+  """Internal helper to decode a BPS relative offset."""
+  return -(value >> 1) if (value & 1) else (value >> 1)
+
+
+def apply_bps(patch: ByteString, source: ByteString, target: ByteString):
+  """
+  Applies a BPS patch. `target` must be a writable buffer that is
+  `patch_size()` bytes long. Source, target and patch CRCs are all checked.
+  """
+  end = len(patch) - 12
+  source_crc, target_crc, patch_crc = [
+    int.from_bytes(patch[i:i+4], "little") for i in range(end, end + 12, 4)
+    ]
+
+  if crc32(memoryview(patch)[:-4]) != patch_crc:
+    raise ValueError("BPS patch is corrupt: patch CRC mismatch.")
+
+  source_size, target_size, pos = _bps_header(patch)
+
+  if (len(source) != source_size) or (crc32(source) != source_crc):
+    raise ValueError("BPS patch does not apply to this source file.")
+
+  if len(target) != target_size:
+    raise ValueError(f"BPS target must be {target_size} bytes long.")
+
+  out, source_rel, target_rel = 0, 0, 0
+
+  while pos < end:
+    data, pos = _bps_number(patch, pos)
+    command, length = data & 3, (data >> 2) + 1
+
+    if out + length > target_size:
+      raise ValueError(f"BPS patch is corrupt: action at {out} runs past "
+        "the end of the target.")
+
+    match command:
+
+      case 0: # SourceRead
+        if out + length > source_size:
+          raise ValueError("BPS patch is corrupt: bad SourceRead length.")
+        target[out:out+length] = source[out:out+length]
+
+      case 1: # TargetRead
+        if pos + length > end:
+          raise ValueError("BPS patch is corrupt: bad TargetRead length.")
+        target[out:out+length] = patch[pos:pos+length]
+        pos += length
+
+      case 2: # SourceCopy
+        data, pos = _bps_number(patch, pos)
+        source_rel += _bps_signed(data)
+        if (source_rel < 0) or (source_rel + length > source_size):
+          raise ValueError("BPS patch is corrupt: bad SourceCopy offset.")
+        target[out:out+length] = source[source_rel:source_rel+length]
+        source_rel += length
+
+      case 3: # TargetCopy
+        data, pos = _bps_number(patch, pos)
+        target_rel += _bps_signed(data)
+
+        if not (0 <= target_rel < out):
+          raise ValueError("BPS patch is corrupt: bad TargetCopy offset.")
+
+        # Copies that overlap the output repeat the
+        # bytes between the copy start and the output.
+        period = out - target_rel
+        chunk = target[target_rel:target_rel+min(length, period)]
+        if length > period:
+          chunk = (chunk * ((length // period) + 1))[:length]
+        target[out:out+length] = chunk
+        target_rel += length
+
+    out += length
+
+  if crc32(target) != target_crc:
+    raise ValueError("BPS patch produced a bad target: target CRC mismatch.")
+
+
+# Generic
+
+
+def patch_size(patch: ByteString, source_size: int) -> int:
+  """Gets the size of the output of applying a patch to a source."""
+  if patch[:5] == IPS_MAGIC:
+    return _ips_size(patch, source_size)
+  elif patch[:4] == BPS_MAGIC:
+    return _bps_header(patch)[1]
+  else:
+    raise ValueError("Unknown patch format.")
+
+
+def apply_patch(patch: ByteString, source: ByteString, target: ByteString):
+  """
+  Applies an IPS or BPS patch to `source`, writing the result to `target`,
+  which must be a writable buffer that is `patch_size()` bytes long.
+  """
+  if patch[:5] == IPS_MAGIC:
+    apply_ips(patch, source, target)
+  elif patch[:4] == BPS_MAGIC:
+    apply_bps(patch, source, target)
+  else:
+    raise ValueError("Unknown patch format.")
@@ -0,0 +1,329 @@
+
+import os
+import sys
+import json
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Iterable, Iterator, Optional, TextIO
+from .memory import unlorom
+
+
+__all__ = [
+  "SymbolTable",
+  "normalize_label", "parse_symbol",
+  "symbol_formats", "export_symbols",
+  ]
+
+
+CACHE_MAGIC = b"FE5S"
+CACHE_VERSION = 1
+CACHE_EXTENSION = ".cache"
+
+# magic, version, source size, source mtime, symbol count, pool size
+_cache_header = struct.Struct("<4sIQQII")
+
+
+def normalize_label(label: str) -> str:
+  """
+  Converts a 64tass VICE label into the form bsnes-plus expects,
+  removing leading periods and changing the scope character
+  from a colon to a period.
+  """
+  return label.lstrip(".").replace(":", ".")
+
+
+def parse_symbol(line: str) -> Optional[tuple[int, str]]:
+  """
+  Parses a line in the form `al ADDRESS label`, which covers both 64tass'
+  VICE output and bsnes-plus symbol files. Returns (address, label)
+  with the label normalized, or None for blank lines.
+  """
+  if not (parts := line.split()):
+    return None
+  _, address, label = parts
+  return (int(address, 16), normalize_label(label))
+
+
+def _cache_name(filename: str) -> str:
+  """Internal helper to get the name of a symbol file's cache."""
+  return filename + CACHE_EXTENSION
+
+
+def _stat(filename: str) -> tuple[int, int]:
+  """Internal helper to get the (size, mtime) used to validate a cache."""
+  s = os.stat(filename)
+  return (s.st_size, s.st_mtime_ns)
+
+
+class SymbolTable:
+  """
+  A sorted table of symbols, stored as parallel arrays of addresses,
+  nesting depths and offsets into a pool of UTF-8 label text.
+
+  Symbols are ordered by address, then by nesting depth, then by label
+  length so that a table comes before its first entry, which comes
+  before that entry's first field.
+  """
+
+  def __init__(
+      self,
+      addresses: Optional[array] = None,
+      depths: Optional[array] = None,
+      offsets: Optional[array] = None,
+      pool: bytes = b"",
+      ):
+    self.addresses = addresses if addresses is not None else array("I")
+    self.depths = depths if depths is not None else array("B")
+    self.offsets = offsets if offsets is not None else array("I", [0])
+    self.pool = pool
+    self._index = None
+
+  def __len__(self):
+    return len(self.addresses)
+
+  def __iter__(self) -> Iterator[tuple[int, str]]:
+    for i in range(len(self)):
+      yield (self.addresses[i], self.label(i))
+
+  def __contains__(self, label: str):
+    return label in self.index
+
+  def __repr__(self):
+    return f"{self.__class__.__name__}(<{len(self)} symbols>)"
+
+  @property
+  def index(self) -> dict:
+    """A {label: position, ...} dict, built on first use."""
+    if self._index is None:
+      self._index = {self.label(i): i for i in range(len(self))}
+    return self._index
+
+  def label(self, i: int) -> str:
+    """Gets the label of the symbol at position `i`."""
+    return self.pool[self.offsets[i]:self.offsets[i+1]].decode("UTF-8")
+
+  def address(self, label: str) -> int:
+    """Gets the address of a label. Raises KeyError if it doesn't exist."""
+    return self.addresses[self.index[label]]
+
+  def at(self, address: int) -> list[str]:
+    """Gets all labels at an address, outermost first."""
+    start = bisect_left(self.addresses, address)
+    end = bisect_right(self.addresses, address, start)
+    return [self.label(i) for i in range(start, end)]
+
+  def nearest(self, address: int) -> Optional[tuple[int, str]]:
+    """
+    Gets the (address, label) of the outermost symbol at or before
+    an address, or None if there are no symbols before it.
+    """
+    i = bisect_right(self.addresses, address)
+    if i == 0:
+      return None
+    found = self.addresses[i-1]
+    i = bisect_left(self.addresses, found, 0, i)
+    return (found, self.label(i))
+
+  def to_bsnes(self) -> Iterator[str]:
+    """Yields the table as bsnes-plus symbol lines."""
+    for (address, label) in self:
+      yield f"al {address:06X} {label}\n"
+
+  @classmethod
+  def from_lines(cls, lines: Iterable[str]):
+    """
+    Creates a SymbolTable from lines in the form `al ADDRESS label`,
+    which covers both 64tass' VICE output and bsnes-plus symbol files.
+    """
+    keys, labels = [], []
+    for line in lines:
+      if (symbol := parse_symbol(line)) is None:
+        continue
+      address, label = symbol
+      label = label.encode("UTF-8")
+      depth = min(label.count(b"."), 0xFF)
+      keys.append(
+        (address << 24) | (depth << 16) | min(len(label), 0xFFFF)
+        )
+      labels.append(label)
+
+    # Packing the sort key into a single int keeps
+    # the one sort we do cheap. The sort is stable, so
+    # otherwise-equal symbols keep their file order.
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+
+    addresses, depths, offsets = array("I"), array("B"), array("I", [0])
+    pool = bytearray()
+    for i in order:
+      key = keys[i]
+      addresses.append(key >> 24)
+      depths.append((key >> 16) & 0xFF)
+      pool += labels[i]
+      offsets.append(len(pool))
+
+    return cls(addresses, depths, offsets, bytes(pool))
+
+  @classmethod
+  def from_file(cls, filename: str, write_cache: bool = False):
+    """
+    Creates a SymbolTable from a symbol file. An up to date binary cache
+    next to the file is used if one exists. A new cache is only written
+    if `write_cache` is set.
+    """
+    if (table := cls.load_cache(filename)) is not None:
+      return table
+
+    with open(filename, "r", encoding="UTF-8") as i:
+      table = cls.from_lines(i)
+
+    if write_cache:
+      table.save_cache(filename)
+
+    return table
+
+  @classmethod
+  def load_cache(cls, filename: str):
+    """
+    Loads the binary cache for a symbol file. Returns None if the
+    cache is missing or out of date.
+    """
+    try:
+      with open(_cache_name(filename), "rb") as i:
+        data = i.read()
+      stat = _stat(filename)
+    except OSError:
+      return None
+
+    if len(data) < _cache_header.size:
+      return None
+
+    magic, version, size, mtime, count, poolsize = \
+      _cache_header.unpack_from(data)
+
+    if (magic, version, (size, mtime)) != (CACHE_MAGIC, CACHE_VERSION, stat):
+      return None
+
+    addresses, depths, offsets = array("I"), array("B"), array("I")
+    pos = _cache_header.size
+    for (a, n) in ((addresses, count), (depths, count), (offsets, count+1)):
+      a.frombytes(data[pos:pos+(n * a.itemsize)])
+      pos += n * a.itemsize
+    pool = data[pos:pos+poolsize]
+
+    if (len(offsets) != count + 1) or (len(pool) != poolsize):
+      return None
+
+    if sys.byteorder != "little":
+      addresses.byteswap()
+      offsets.byteswap()
+
+    return cls(addresses, depths, offsets, pool)
+
+  def save_cache(self, filename: str):
+    """
+    Saves a binary cache for a symbol file, keyed to the file's
+    current size and modification time.
+    """
+    size, mtime = _stat(filename)
+    addresses, offsets = array("I", self.addresses), array("I", self.offsets)
+
+    if sys.byteorder != "little":
+      addresses.byteswap()
+      offsets.byteswap()
+
+    with open(_cache_name(filename), "wb") as o:
+      o.write(_cache_header.pack(
+        CACHE_MAGIC, CACHE_VERSION, size, mtime, len(self), len(self.pool),
+        ))
+      o.write(addresses.tobytes())
+      o.write(self.depths.tobytes())
+      o.write(offsets.tobytes())
+      o.write(self.pool)
+
+
+# Debugger symbol formats
+
+
+def _bsnes(address: int, label: str) -> Optional[str]:
+  """Formats a symbol for bsnes-plus."""
+  return f"al {address:06X} {label}\n"
+
+
+def _mesen(address: int, label: str) -> Optional[str]:
+  """
+  Formats a symbol for Mesen's .mlb files. Mesen labels are relative to
+  a memory type rather than the CPU address space and can't contain
+  periods. Symbols that don't map to a supported memory type are skipped.
+  """
+  bank, offset = (address >> 16) & 0xFF, address & 0xFFFF
+  label = label.replace(".", "_")
+
+  if bank in (0x7E, 0x7F):
+    return f"SnesWorkRam:{address - 0x7E0000:X}:{label}\n"
+
+  elif offset >= 0x8000:
+    return f"SnesPrgRom:{unlorom(address):X}:{label}\n"
+
+  elif (bank & 0x7F) < 0x40:
+    if offset < 0x2000:
+      return f"SnesWorkRam:{offset:X}:{label}\n"
+    elif (0x2100 <= offset < 0x2200) or (0x4000 <= offset < 0x4400):
+      return f"SnesRegister:{offset:X}:{label}\n"
+
+  elif 0x70 <= bank < 0x7E:
+    return f"SnesSaveRam:{((bank - 0x70) * 0x8000) + offset:X}:{label}\n"
+
+  return None
+
+
+def _wla(address: int, label: str) -> Optional[str]:
+  """Formats a symbol for WLA-style .sym files."""
+  return f"{address >> 16:02X}:{address & 0xFFFF:04X} {label}\n"
+
+
+def _json(address: int, label: str) -> Optional[str]:
+  """Formats a symbol as a JSON object member."""
+  return f"  {json.dumps(label)}: {address}"
+
+
+# name: (extension, header, formatter, separator, footer)
+symbol_formats = {
+  "bsnes": (".bsnes.sym", "", _bsnes, "", ""),
+  "mesen": (".mlb", "", _mesen, "", ""),
+  "wla": (".wla.sym", "[labels]\n", _wla, "", ""),
+  "json": (".json", "{\n", _json, ",\n", "\n}\n"),
+  }
+
+
+def export_symbols(lines: Iterable[str], outputs: dict[str, TextIO]) -> int:
+  """
+  Converts symbol lines into several formats at once, writing each symbol
+  to every output as it's read. `outputs` is a {format name: file, ...}
+  dict using names from `symbol_formats`. Returns the number of symbols read.
+  """
+  formats = {name: symbol_formats[name] for name in outputs}
+  first = {name: True for name in outputs}
+
+  for (name, o) in outputs.items():
+    o.write(formats[name][1])
+
+  count = 0
+  for line in lines:
+    if (symbol := parse_symbol(line)) is None:
+      continue
+    count += 1
+
+    for (name, o) in outputs.items():
+      _, _, formatter, separator, _ = formats[name]
+      if (text := formatter(*symbol)) is None:
+        continue
+      if not first[name]:
+        o.write(separator)
+      first[name] = False
+      o.write(text)
+
+  for (name, o) in outputs.items():
+    o.write(formats[name][4])
+
+  return count
@@ -0,0 +1,311 @@
+
+import re
+import struct
+from typing import Iterator, NamedTuple, Optional, Sequence
+from .symbols import SymbolTable
+
+
+__all__ = [
+  "FieldType", "Layout",
+  "RangeType", "SymbolType", "EnumType",
+  "parse_number", "parse_type",
+  ]
+
+
+_field_re = re.compile(r"([usp])(8|16|24|32)(le|be)?")
+
+_range_re = re.compile(r"(-?[$%]?\w+)\.\.(-?[$%]?\w+)")
+
+_struct_codes = {1: "B", 2: "H", 4: "I"}
+
+
+def parse_number(text: str) -> Optional[int]:
+  """
+  Parses a 64tass-style number: decimal, `$` hexadecimal or `%` binary,
+  with an optional sign. `0x` hexadecimal is also accepted.
+  Returns None if the text isn't a number.
+  """
+  text = text.strip()
+  sign = -1 if text.startswith("-") else 1
+  text = text.lstrip("+-")
+  try:
+    if text.startswith("$"):
+      return sign * int(text[1:], 16)
+    elif text.startswith("%"):
+      return sign * int(text[1:], 2)
+    elif text.lower().startswith("0x"):
+      return sign * int(text[2:], 16)
+    return sign * int(text, 10)
+  except ValueError:
+    return None
+
+
+class FieldType(NamedTuple):
+  """
+  The binary layout of a single table field.
+
+  Written as `u8`, `s16`, `p24`, etc., where `u` is unsigned, `s` is
+  signed and `p` is a pointer. Pointers are unsigned and may be given
+  as symbols, which are truncated to the field's size. A `be` suffix
+  makes a field big-endian, the default is little-endian.
+  """
+  size: int
+  signed: bool = False
+  pointer: bool = False
+  big_endian: bool = False
+
+  def __str__(self):
+    kind = "p" if self.pointer else ("s" if self.signed else "u")
+    return f"{kind}{self.size * 8}{'be' if self.big_endian else ''}"
+
+  @property
+  def byteorder(self) -> str:
+    return "big" if self.big_endian else "little"
+
+  @property
+  def minimum(self) -> int:
+    return -(1 << ((self.size * 8) - 1)) if self.signed else 0
+
+  @property
+  def maximum(self) -> int:
+    bits = (self.size * 8) - (1 if self.signed else 0)
+    return (1 << bits) - 1
+
+  @classmethod
+  def parse(cls, text: str):
+    """Creates a FieldType from text like `u16` or `s24be`."""
+    if (m := _field_re.fullmatch(text.strip().lower())) is None:
+      raise ValueError(f"Unknown field type {text}.")
+    kind, bits, endianness = m.groups()
+    return cls(int(bits) // 8, kind == "s", kind == "p", endianness == "be")
+
+  def resolve(self, text: str, symbols: Optional[SymbolTable] = None) -> int:
+    """
+    Converts a cell into a value for this field. Cells may be numbers or,
+    if a symbol table is given, symbols. Raises ValueError if the cell
+    can't be converted or is out of range for the field.
+    """
+    if (value := parse_number(text)) is None:
+      label = text.strip()
+      if (symbols is None) or (label not in symbols):
+        raise ValueError(f"Unknown value {text!r} for {self} field.")
+      value = symbols.address(label)
+
+    if self.pointer:
+      value &= self.maximum
+
+    if not (self.minimum <= value <= self.maximum):
+      raise ValueError(f"Value {text!r} out of range for {self} field.")
+
+    return value
+
+  def format(self, value: int, symbols: Optional[SymbolTable] = None) -> str:
+    """
+    Formats a value as a cell that `resolve` accepts. Signed fields are
+    written in decimal and everything else in hexadecimal. Pointers are
+    written as labels if a symbol table is given and has a label
+    at the address.
+    """
+    if self.pointer and (symbols is not None):
+      if (labels := symbols.at(value)):
+        return labels[0]
+
+    if self.signed:
+      return str(value)
+
+    return f"${value:0{self.size * 2}X}"
+
+
+class RangeType(NamedTuple):
+  """An integer column limited to `minimum..maximum`, inclusive."""
+  minimum: int
+  maximum: int
+
+  def __str__(self):
+    return f"{self.minimum}..{self.maximum}"
+
+  def resolve(self, text: str, symbols: Optional[SymbolTable] = None) -> int:
+    """Converts a cell into a number, raising ValueError if out of range."""
+    if (value := parse_number(text)) is None:
+      raise ValueError(f"{text!r} isn't a number.")
+    if not (self.minimum <= value <= self.maximum):
+      raise ValueError(f"Value {text!r} isn't in the range {self}.")
+    return value
+
+  def format(self, value: int, symbols: Optional[SymbolTable] = None) -> str:
+    return str(value)
+
+
+class SymbolType(NamedTuple):
+  """A column of labels, resolved to their addresses."""
+
+  def __str__(self):
+    return "sym"
+
+  def resolve(self, text: str, symbols: Optional[SymbolTable] = None) -> int:
+    """Looks up a label, raising ValueError if it doesn't exist."""
+    label = text.strip()
+    if symbols is None:
+      raise ValueError(f"No symbol file given for label {text!r}.")
+    if label not in symbols:
+      raise ValueError(f"Unknown label {text!r}.")
+    return symbols.address(label)
+
+  def format(self, value: int, symbols: Optional[SymbolTable] = None) -> str:
+    return f"${value:06X}"
+
+
+class EnumType(NamedTuple):
+  """A column of names from a fixed set, each with its own value."""
+  name: str
+  members: dict
+
+  def __str__(self):
+    return f"enum:{self.name}"
+
+  def resolve(self, text: str, symbols: Optional[SymbolTable] = None) -> int:
+    """Looks up a member, raising ValueError if it doesn't exist."""
+    try:
+      return self.members[text.strip()]
+    except KeyError:
+      raise ValueError(f"{text!r} isn't in {self.name}.") from None
+
+  def format(self, value: int, symbols: Optional[SymbolTable] = None) -> str:
+    return str(value)
+
+
+def parse_type(text: str):
+  """
+  Parses a column type: a field type like `u8` or `p24`,
+  a range like `1..20` or `sym` for labels. Enums can't
+  be parsed from text alone, so `enum:` types are left
+  to the caller. Raises ValueError for unknown types.
+  """
+  text = text.strip()
+
+  if text.lower() == "sym":
+    return SymbolType()
+
+  if (m := _range_re.fullmatch(text)) is not None:
+    minimum, maximum = (parse_number(g) for g in m.groups())
+    if (minimum is None) or (maximum is None) or (minimum > maximum):
+      raise ValueError(f"Invalid range {text}.")
+    return RangeType(minimum, maximum)
+
+  return FieldType.parse(text)
+
+
+class Layout:
+  """
+  The binary layout of a table row: a sequence of FieldTypes
+  packed together with no padding.
+  """
+
+  def __init__(self, fields: Sequence[FieldType]):
+    self.fields = list(fields)
+    self.size = sum(f.size for f in self.fields)
+
+    # Little-endian 8/16/32-bit fields go straight through struct.
+    # Everything else is packed as raw bytes.
+    self._raw = [
+      (f.size not in _struct_codes) or (f.big_endian and f.size > 1)
+      for f in self.fields
+      ]
+    codes = [
+      f"{f.size}s" if raw else _struct_codes[f.size]
+      for (f, raw) in zip(self.fields, self._raw)
+      ]
+    codes = [c.lower() if f.signed else c for (c, f) in zip(codes, self.fields)]
+    self._struct = struct.Struct("<" + "".join(codes))
+
+  def __len__(self):
+    return len(self.fields)
+
+  def __str__(self):
+    return " ".join(str(f) for f in self.fields)
+
+  def __repr__(self):
+    return f"Layout({str(self)!r})"
+
+  @classmethod
+  def parse(cls, text: str):
+    """Creates a Layout from field types separated by spaces or commas."""
+    return cls([FieldType.parse(t) for t in text.replace(",", " ").split()])
+
+  def resolve(
+      self,
+      index: int,
+      text: str,
+      symbols: Optional[SymbolTable] = None,
+      ) -> int:
+    """Converts a cell into a value for the field at `index`."""
+    return self.fields[index].resolve(text, symbols)
+
+  def pack(self, values: Sequence[int]) -> bytes:
+    """Packs a row of values into native data."""
+    packed = []
+    for (value, f, raw) in zip(values, self.fields, self._raw):
+      if raw:
+        value = value.to_bytes(f.size, f.byteorder, signed=f.signed)
+      packed.append(value)
+    return self._struct.pack(*packed)
+
+  def unpack(self, data: bytes, offset: int = 0) -> tuple:
+    """Unpacks a row of values from native data."""
+    values = list(self._struct.unpack_from(data, offset))
+    for (i, (f, raw)) in enumerate(zip(self.fields, self._raw)):
+      if raw:
+        values[i] = int.from_bytes(values[i], f.byteorder, signed=f.signed)
+    return tuple(values)
+
+  def unpack_table(
+      self,
+      data: bytes,
+      offset: int,
+      count: int,
+      stride: Optional[int] = None,
+      ) -> Iterator[tuple]:
+    """
+    Unpacks `count` rows starting at `offset`, `stride` bytes apart.
+    The stride defaults to the size of a row.
+    """
+    stride = self.size if stride is None else stride
+
+    if stride < self.size:
+      raise ValueError(f"Stride {stride} is smaller than the row size.")
+
+    end = offset + ((count - 1) * stride) + self.size
+    if (count > 0) and ((offset < 0) or (end > len(data))):
+      raise ValueError(f"Table at ${offset:06X} runs past the end of the data.")
+
+    # Tightly-packed tables are unpacked by struct in one call.
+    if stride == self.size:
+      rows = self._struct.iter_unpack(data[offset:offset+(count * stride)])
+    else:
+      rows = (
+        self._struct.unpack_from(data, offset + (i * stride))
+        for i in range(count)
+        )
+
+    raw = [
+      (i, f) for (i, (f, r)) in enumerate(zip(self.fields, self._raw)) if r
+      ]
+
+    if not raw:
+      yield from rows
+      return
+
+    for row in rows:
+      row = list(row)
+      for (i, f) in raw:
+        row[i] = int.from_bytes(row[i], f.byteorder, signed=f.signed)
+      yield tuple(row)
+
+  def format(
+      self,
+      index: int,
+      value: int,
+      symbols: Optional[SymbolTable] = None,
+      ) -> str:
+    """Formats a value from the field at `index` as a cell."""
+    return self.fields[index].format(value, symbols)
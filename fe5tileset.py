@@ -1,7 +1,9 @@
 #!/usr/bin/python3
 
 
+import sys
 import argparse
+from PIL import Image
 from fe5py.maps import MapTileset
 
 
@@ -12,7 +14,7 @@ def main():
     )
   parser.add_argument(
     "mode",
-    choices = ["create", "update", "export"],
+    choices = ["create", "update", "export", "import"],
     )
   parser.add_argument(
     "filepath",
@@ -24,6 +26,15 @@ def main():
     nargs = "?",
     default = None,
     )
+  parser.add_argument(
+    "--image",
+    help = "RGB tileset image to import",
+    )
+  parser.add_argument(
+    "--dedup",
+    action = "store_true",
+    help = "merge tiles that are the same up to a flip when exporting",
+    )
 
   args = parser.parse_args()
 
@@ -39,8 +50,22 @@ def main():
 
     case "export":
       ts = MapTileset.from_tmxfile(args.filepath)
+      if args.dedup:
+        ts.deduplicate()
       ts.to_bytes(args.filepath)
 
+    case "import":
+      if args.image is None:
+        parser.error("import requires --image")
+      ts = MapTileset.from_tmxfile(args.filepath)
+      try:
+        lost = ts.import_image(Image.open(args.image))
+      except ValueError as e:
+        sys.exit(f"Unable to import {args.image}: {e}")
+      if lost:
+        print(f"{lost} tile colors didn't fit and were approximated.")
+      ts.to_tmx(args.filepath)
+
 
 if __name__ == '__main__':
   main()
@@ -1,6 +1,7 @@
 #!/usr/bin/python3
 
-import sys
+import argparse
+from fe5py.symbols import SymbolTable
 
 """
 This is a simple script to fix
@@ -11,35 +12,29 @@ It has three goals:
 Ensure addresses are 6 characters long
 remove periods at the start of label names
 change the scope character from colon to period
+
+Symbols are sorted such that the order of
+symbols at the same address is table->entry->entry field.
+With --cache, a binary cache of the fixed
+symbols is saved next to the file for other
+tools to use.
 """
 
 if __name__ == "__main__":
 
-    symfile = sys.argv[1]
-
-    with open(symfile, "r", encoding="UTF-8") as i:
-        lines = i.readlines()
-
-    fixed = []
-
-    for line in lines:
-        _, address, label = line.split()
-        label = label.lstrip(".").replace(":", ".")
-        fixed.append(f"al {int(address, 16):06X} {label}\n")
+    parser = argparse.ArgumentParser(
+        description="Fixes 64tass' symbol output for use with bsnes-plus.")
+    parser.add_argument("symfile")
+    parser.add_argument(
+        "--cache", action="store_true",
+        help="also save a binary cache next to the symbol file")
+    args = parser.parse_args()
 
-    def keyfunc(string):
-        """
-        Turn a VICE symbol line into a sorting key value.
+    with open(args.symfile, "r", encoding="UTF-8") as i:
+        symbols = SymbolTable.from_lines(i)
 
-        This aims to help when sorting lines with the same
-        address, like a table and its first entry, along with
-        the first part of the first entry. We want to ensure
-        that the order is table->entry->entry field.
-        """
-        _, address, symbol = string.split()
-        address = int("0x" + address, 16)
-        nesting_level = symbol.count(".")
-        return (address, nesting_level, len(symbol))
+    with open(args.symfile, "w", encoding="UTF-8") as o:
+        o.writelines(symbols.to_bsnes())
 
-    with open(symfile, "w", encoding="UTF-8") as o:
-        o.writelines(sorted(fixed, key=keyfunc))
+    if args.cache:
+        symbols.save_cache(args.symfile)
@@ -3,7 +3,7 @@
 import os
 import sys
 from PIL import Image
-from fe5py.graphics import Color, Palette, rect
+from fe5py.graphics import Color, Palette, encode_image, rect
 
 
 sword_template = [
@@ -100,13 +100,6 @@ palette_zones = {
   }
 
 
-def convert_im(im, palette):
-  new = Image.new("P", im.size, palette[0].to_rgb())
-  new.putpalette([b for c in palette for b in c.to_rgb()])
-  new.putdata([palette.colors.index(Color(c)) for c in im.getdata()])
-  return new
-
-
 def main():
 
   _, infile = sys.argv
@@ -138,8 +131,13 @@ def main():
   for source, size, dest in template:
     formatted.paste(im.crop(rect(source, size)), dest)
 
-  new = convert_im(formatted, base_palette)
-  new.save(os.path.join(dirname, name+"FormattedWeapon.png"))
+  try:
+    data, _ = encode_image(formatted, base_palette)
+  except ValueError as e:
+    sys.exit(f"Unable to encode weapon: {e}")
+
+  with open(os.path.join(dirname, name+"FormattedWeapon.4bpp"), "wb") as o:
+    o.write(data)
 
   for i in range(7):
     palette = Palette(list(im.crop(rect((x, y+i), (16, 1))).getdata()))
@@ -3,23 +3,19 @@
 import sys
 import os
 from PIL import Image
-from fe5py.graphics import Palette, rect
+from fe5py.graphics import Palette, encode_image, rect
 
 def main():
 
   # Example: python format_portrait.py PORTRAITS/Alba.png
 
-  # Converts a templated portrait into the layout that FE5 expects.
+  # Converts a templated portrait into the layout that FE5 expects
+  # and writes it as native 4bpp tile data.
   # Also processes the portrait's palette(s) into native data.
 
-  # After using this script to format a portrait, you can
-  # turn it into native data using a tool like superfamiconv:
-  # superfamiconv tiles -i SomeFormattedPortrait.png
-  #   -p SomeFormattedPortrait00.pal -d SomeFormattedPortrait.4bpp -B 4 -D -F
-
   infile = sys.argv[1]
   basename = os.path.splitext(infile)[0]
-  outfile = basename + "FormattedPortrait.png"
+  outfile = basename + "FormattedPortrait.4bpp"
   pal_name_template = basename + "FormattedPortrait{0:02X}.pal"
 
   im = Image.open(infile).convert("RGB")
@@ -34,7 +30,13 @@ def main():
   formatted_im.paste(upper, ( 0, 0))
   formatted_im.paste(lower, (48, 0))
 
-  formatted_im.save(outfile)
+  try:
+    data, _ = encode_image(formatted_im, default_palette)
+  except ValueError as e:
+    sys.exit(f"Unable to encode portrait: {e}")
+
+  with open(outfile, "wb") as o:
+    o.write(data)
 
   bg_color = default_palette[0]
 
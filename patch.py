@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import mmap
+import argparse
+from fe5py.memory import fix_checksum
+from fe5py.patch import patch_size, apply_patch
+
+
+def main():
+
+  parser = argparse.ArgumentParser(
+    description = "Applies IPS/BPS patches to a ROM and fixes its checksum.",
+    epilog = "Patches are applied in the order given.",
+    )
+  parser.add_argument(
+    "ROMfile",
+    help = "base ROM",
+    )
+  parser.add_argument(
+    "outfile",
+    help = "patched ROM",
+    )
+  parser.add_argument(
+    "patches",
+    nargs = "+",
+    metavar = "patch",
+    help = "IPS or BPS patch",
+    )
+  parser.add_argument(
+    "--no-checksum",
+    action = "store_true",
+    help = "don't update the ROM header checksum",
+    )
+
+  args = parser.parse_args()
+
+  with open(args.ROMfile, "rb") as i:
+    data = i.read()
+
+  # Intermediate results stay in memory, only the final
+  # patch is streamed into the mapped output file.
+
+  *intermediate, name = args.patches
+
+  try:
+    for name in intermediate:
+      with open(name, "rb") as i:
+        patch = i.read()
+
+      out = bytearray(patch_size(patch, len(data)))
+      apply_patch(patch, data, out)
+      data = out
+
+    name = args.patches[-1]
+
+    with open(name, "rb") as i:
+      patch = i.read()
+
+    size = patch_size(patch, len(data))
+
+    # The ROM is patched in a temporary file that only
+    # replaces the output once everything has succeeded.
+    temp = args.outfile + ".tmp"
+
+    try:
+      with open(temp, "w+b") as o:
+        o.truncate(size)
+
+        with mmap.mmap(o.fileno(), size) as out:
+          apply_patch(patch, data, out)
+
+          if not args.no_checksum:
+            fixed = fix_checksum(out)
+          else:
+            fixed = None
+
+      os.replace(temp, args.outfile)
+
+    except BaseException:
+      if os.path.exists(temp):
+        os.unlink(temp)
+      raise
+
+    if fixed is not None:
+      checksum, complement = fixed
+      print(f"New checksums for ROM {args.outfile}:")
+      print(f"Checksum:   0x{checksum:04X}")
+      print(f"Complement: 0x{complement:04X}")
+
+  except ValueError as e:
+    sys.exit(f"Error applying {name}: {e}")
+
+
+if __name__ == '__main__':
+  main()
@@ -249,7 +249,7 @@ def main():
     pal_offset = image_palettes + (shared_palettes[0] * 0x1E)
 
     palette = Palette.from_bytes(ROM, 15, pal_offset)
-    palette.colors.insert(0, COLOR_0)
+    palette.insert(0, COLOR_0)
 
     raw, _ = decompress(ROM, gfx_offset)
     raw_im = rip_image(raw, (128, 16), palette, indexed_output=False)
@@ -265,7 +265,7 @@ def main():
       pal_offset = image_palettes + (pal_index * 0x1E)
 
       palette = Palette.from_bytes(ROM, 15, pal_offset)
-      palette.colors.insert(0, COLOR_0)
+      palette.insert(0, COLOR_0)
 
       pal_im = Image.new("RGB", (16, 1))
       pal_im.putdata(palette.to_list())
@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+
+import sys
+import csv
+import mmap
+import json
+import argparse
+from fe5py.memory import unlorom
+from fe5py.symbols import SymbolTable
+from fe5py.tables import Layout, parse_number
+
+"""
+This script extracts tables from a ROM into CSV tables
+that c2a can turn back into 64tass source or binary data.
+
+"""
+
+
+def find_address(text, symbols=None):
+  """Converts a LoROM address or label into a ROM offset."""
+  if (address := parse_number(text)) is None:
+    if (symbols is None) or (text not in symbols):
+      raise ValueError(f"Unknown address {text!r}.")
+    address = symbols.address(text)
+  return unlorom(address)
+
+
+def rip_table(ROM, spec, symbols=None):
+  """
+  Reads a table described by a spec dict, returning its CSV rows.
+
+  The spec has an `address` (a LoROM address or label), a `count` of
+  entries and a `layout` like `u8 u16 p24`. It may also have a `stride`
+  between entries, a list of `fields` names, a list of entry `names` or
+  a name `prefix`, and the `command`, `start` and `step` for c2a.
+  """
+  layout = Layout.parse(spec["layout"])
+  count = int(spec["count"])
+  offset = find_address(str(spec["address"]), symbols)
+
+  fields = spec.get("fields") or [f"Field{i}" for i in range(len(layout))]
+  if len(fields) != len(layout):
+    raise ValueError(
+      f"Layout has {len(layout)} fields, {len(fields)} names given.")
+
+  names = spec.get("names")
+  if names is None:
+    prefix = spec.get("prefix", "Entry")
+    names = [f"{prefix}{i}" for i in range(count)]
+  elif len(names) < count:
+    raise ValueError(f"{count} entries but only {len(names)} names given.")
+
+  command = " ".join([
+    spec.get("command", ".byte"),
+    str(spec.get("start", 0)),
+    str(spec.get("step", 1)),
+    ])
+
+  stride = spec.get("stride")
+  if (stride is not None) and ((stride := parse_number(str(stride))) is None):
+    raise ValueError(f"Invalid stride {spec['stride']!r}.")
+
+  rows = [[command, *fields]]
+  entries = layout.unpack_table(ROM, offset, count, stride)
+  for (name, values) in zip(names, entries):
+    rows.append(
+      [name, *[layout.format(i, v, symbols) for (i, v) in enumerate(values)]]
+      )
+
+  return rows
+
+
+def write_table(outname, rows):
+  """Writes CSV rows to a file."""
+  with open(outname, "w", encoding="UTF-8", newline="") as o:
+    csv.writer(o, lineterminator="\n").writerows(rows)
+
+
+def main():
+
+  parser = argparse.ArgumentParser(
+    description = "Extracts tables from a ROM into c2a-compatible CSV files.",
+    epilog = "Either give a single table's address, count and layout, or "
+      "a JSON spec file with a list of tables.",
+    )
+  parser.add_argument("ROMfile", help="ROM to read tables from")
+  parser.add_argument("outfile", nargs="?", help="CSV file to write")
+  parser.add_argument(
+    "--spec",
+    help = "JSON file with a list of tables, each with an `output` filename",
+    )
+  parser.add_argument("-a", "--address", help="LoROM address or label")
+  parser.add_argument("-n", "--count", type=int, help="number of entries")
+  parser.add_argument("-l", "--layout", help="field types, i.e. \"u8 s16 p24\"")
+  parser.add_argument(
+    "--stride",
+    help = "bytes between entries, defaults to the size of the layout",
+    )
+  parser.add_argument("-f", "--fields", nargs="+", help="field names")
+  parser.add_argument("--names", help="file with one entry name per line")
+  parser.add_argument("--prefix", default="Entry", help="entry name prefix")
+  parser.add_argument("-c", "--command", default=".byte", help="c2a command")
+  parser.add_argument("--start", type=int, default=0, help="first index")
+  parser.add_argument("--step", type=int, default=1, help="index increment")
+  parser.add_argument(
+    "-s", "--symbols",
+    help = "symbol file for labelled addresses and pointers",
+    )
+
+  args = parser.parse_args()
+
+  if args.spec:
+    with open(args.spec, "r", encoding="UTF-8") as i:
+      specs = json.load(i)
+
+  else:
+    if None in (args.outfile, args.address, args.count, args.layout):
+      parser.error("outfile, --address, --count and --layout are required")
+
+    spec = {
+      "output": args.outfile,
+      "address": args.address,
+      "count": args.count,
+      "layout": args.layout,
+      "stride": args.stride,
+      "fields": args.fields,
+      "prefix": args.prefix,
+      "command": args.command,
+      "start": args.start,
+      "step": args.step,
+      }
+
+    if args.names:
+      with open(args.names, "r", encoding="UTF-8") as i:
+        spec["names"] = [line.strip() for line in i if line.strip()]
+
+    specs = [spec]
+
+  symbols = SymbolTable.from_file(args.symbols) if args.symbols else None
+
+  errors = []
+
+  with open(args.ROMfile, "rb") as i:
+    with mmap.mmap(i.fileno(), 0, access=mmap.ACCESS_READ) as ROM:
+
+      for spec in specs:
+        try:
+          rows = rip_table(ROM, spec, symbols)
+        except KeyError as e:
+          errors.append(f"{spec.get('output')}: missing {e}")
+          continue
+        except ValueError as e:
+          errors.append(f"{spec.get('output')}: {e}")
+          continue
+
+        write_table(spec["output"], rows)
+
+  if errors:
+    sys.exit("\n".join(errors))
+
+
+if __name__ == '__main__':
+  main()
@@ -1,12 +1,13 @@
 #!/usr/bin/python3
 
-import posixpath
+import sys
+import queue
 import argparse
-
-include_types = [".include", ".binclude"]
-binary_types = [".binary", "binary(", ".crossbank.start *,"]
-
-NOT_FOUND = -1 # For str.find results
+import posixpath
+import threading
+from os.path import splitext
+from fe5py.includes import DependencyCache, DependencyWatcher
+from fe5py.includes import build_graph, write_depfile
 
 # Argparse stuff
 
@@ -15,104 +16,115 @@ description = "Prints 64tass dependencies to stdout. " \
 
 file_help = "file to scan"
 
-epilog = "This script will also scan any dependencies " \
-    "found for additional dependencies."
+cache_help = "file to cache each scanned file's includes in, " \
+    "so that only changed files are rescanned"
 
-def get_include(d, s):
-    """Tries to find a filename
-    after an include directive.
-    """
-    s = s.replace("'", "\"")
-    start, end = s.find("\""), s.rfind("\"")
-    if start != end:
-        return posixpath.join(d, s[start+1:end])
-    return None
-
-def scan(file, scanned):
-    """Recursively scan a file
-    for includes and print
-    included filenames. Keeps
-    track of already-scanned files.
-    """
+jobs_help = "number of threads to read files with"
 
-    # Issues:
-    # Missing/unclosed directives will
-    # ruin scanning until nesting level returns
-    # to zero.
-    # Includes that use variables for their
-    # filenames instead of quoted strings will
-    # not be caught by this script.
+depfiles_help = "instead of printing dependencies, write a Make " \
+    "depfile for each file, named after the file with a .d extension"
 
-    if not posixpath.isfile(file):
-        return
+target_help = "target name to use in depfiles, where {file} is " \
+    "the scanned file and {base} is the file without its extension " \
+    "(default: {base}.sfc)"
 
-    with open(file, "r", encoding="UTF-8") as i:
-        lines = i.readlines()
+watch_help = "keep running, printing the files that need rebuilding " \
+    "whenever a dependency changes, and answer queries read from stdin"
 
-    d = posixpath.dirname(file)
+interval_help = "seconds between checks for changes in watch mode " \
+    "(default: %(default)s)"
 
-    comment_nesting_level = 0
+epilog = "This script will also scan any dependencies " \
+    "found for additional dependencies."
 
-    for line in lines:
+def watch(args):
+    """Watch mode: keeps the include graph
+    in memory and updates it as files change.
 
-        comment_pos = line.find(";")
-        block_comment_pos = line.find(".comment")
+    Prints `rebuild file ...` with the top-level
+    files that need rebuilding after each change.
+    Reads queries from stdin, one per line:
+    `dependents file` prints everything that includes file,
+    `dependencies file` prints everything file includes,
+    `quit` exits.
+    """
 
-        # If block comment directive exists
-        # and is before any possible line comments.
+    cache = DependencyCache(args.cache)
+    watcher = DependencyWatcher(args.files, cache, args.jobs)
+    cache.save()
 
-        if block_comment_pos != NOT_FOUND:
-            if (comment_pos == NOT_FOUND) or (comment_pos > block_comment_pos):
-                comment_nesting_level += 1
-                continue
+    queries = queue.Queue()
 
-        # If we're in a comment block, scan
-        # for the end of the block rather
-        # than for includes.
+    def read_queries():
+        for line in sys.stdin:
+            queries.put(line)
+        queries.put("quit")
 
-        if comment_nesting_level > 0:
-            block_end_pos = line.find(".endc") # .endcomment too
+    threading.Thread(target=read_queries, daemon=True).start()
 
-            if block_end_pos != NOT_FOUND:
-                if (comment_pos == NOT_FOUND) or (comment_pos > block_end_pos):
-                    comment_nesting_level -= 1
+    while True:
 
-            # Line still gets ignored
+        if changed := watcher.poll():
+            cache.save()
+            if targets := watcher.targets(changed):
+                print("rebuild", *targets, flush=True)
+
+        try:
+            query = queries.get(timeout=args.interval)
+        except queue.Empty:
             continue
 
-        for inc_type in include_types + binary_types:
-            inc_pos = line.find(inc_type)
+        command, _, file = query.strip().partition(" ")
+        file = posixpath.normpath(file) if file else file
+
+        if command == "quit":
+            break
+        elif command == "dependents":
+            print(f"dependents {file}:", *sorted(watcher.dependents(file)),
+                flush=True)
+        elif command == "dependencies":
+            print(f"dependencies {file}:", *watcher.dependencies(file),
+                flush=True)
+        elif command:
+            print(f"unknown query {command}", flush=True)
 
-            if inc_pos == NOT_FOUND:
-                continue
+if __name__ == "__main__":
 
-            # Commented-out includes
-            if (comment_pos != NOT_FOUND) and (inc_pos > comment_pos):
-                continue
+    parser = argparse.ArgumentParser(description=description, epilog=epilog)
+    parser.add_argument("files", nargs="+", metavar="file", help=file_help)
+    parser.add_argument("-c", "--cache", help=cache_help)
+    parser.add_argument("-j", "--jobs", type=int, help=jobs_help)
+    parser.add_argument("-M", "--depfiles", action="store_true",
+        help=depfiles_help)
+    parser.add_argument("-T", "--target", default="{base}.sfc",
+        help=target_help)
+    parser.add_argument("-w", "--watch", action="store_true", help=watch_help)
+    parser.add_argument("-i", "--interval", type=float, default=0.5,
+        help=interval_help)
+    args = parser.parse_args()
 
-            # Try to get a valid path
-            # from include
-            p = get_include(d, line[inc_pos:])
-            if not p:
-                continue
+    if args.watch:
+        watch(args)
+        sys.exit()
 
-            p = posixpath.normpath(p)
+    files = list(dict.fromkeys(args.files))
 
-            if p not in scanned:
-                scanned.add(p)
-                print(p)
+    cache = DependencyCache(args.cache)
+    graph = build_graph(files, cache, args.jobs)
+    cache.save()
 
-                # Check if that file has any
-                # includes
-                if not (inc_type in binary_types):
-                    scan(p, scanned)
+    if args.depfiles:
+        for file in files:
+            base = splitext(file)[0]
+            target = args.target.format(file=file, base=base)
 
-if __name__ == "__main__":
+            # A target can't be one of its own prerequisites.
+            source = file if (file != target) else None
+            deps = [d for d in graph.closure([file]) if d != target]
 
-    parser = argparse.ArgumentParser(description=description, epilog=epilog)
-    parser.add_argument("files", nargs="+", metavar="file", help=file_help)
-    args = parser.parse_args()
+            with open(base + ".d", "w", encoding="UTF-8") as o:
+                write_depfile(target, deps, o, source)
 
-    scanned = set()
-    for file in set(args.files):
-        scan(file, scanned)
+    else:
+        for p in graph.closure(files):
+            print(p)